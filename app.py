@@ -1,33 +1,126 @@
-from fastapi import FastAPI, Request, Depends, HTTPException, Response, Form
+from fastapi import FastAPI, Request, Depends, HTTPException, Response, Form, File, UploadFile, Query
 from auth import AuthHandler
-from schemas import AuthDetails, WordDetails, DeleteWord
+from schemas import AuthDetails, WordDetails, WordDetailsBatch, DeleteWord
 import string
-from helpers import clean_dict, update_box, days_hours_mins, start_email_scheduler
+from helpers import update_box, start_email_scheduler, MAX_BOX
+from scheduling import update_boxes
+from definitions import DefinitionCache, DictionaryClient, DictionaryUnavailable, normalise_word
+from metrics import LoopLagMonitor, MetricsMiddleware, instrument_engine, registry
+from hashing import PasswordHashPool
+from due import DueSummaryCache, is_due
+from pagination import paginate, split_page, MAX_PAGE_SIZE
+from etags import RenderedPageCache, bump_version, get_version, make_etag, not_modified, set_etag
+from importer import import_words, parse_word_list, MAX_IMPORT_WORDS
+from notify import DueNotifier, RECHECK_SECONDS
+from stats import ReviewLog, apply_events, read_stats, review_event
+from review_queue import ReviewSessions, REVIEW_BATCH_SIZE, MAX_REVIEW_BATCH_SIZE
 from validate_email_address import validate_email
 
-from models import User, Word, engine
-from sqlmodel import SQLModel, Session, select
+from models import User, Word, Definition
+from database import get_engine, get_async_engine, get_session, insert_for
+from sqlmodel import SQLModel, select
+from sqlmodel.ext.asyncio.session import AsyncSession
+from sqlalchemy import update as update_rows, delete as delete_rows, not_
 from starlette.status import HTTP_403_FORBIDDEN, HTTP_401_UNAUTHORIZED
-from typing import Optional
+from typing import Optional, List
 
-from fastapi.responses import HTMLResponse, RedirectResponse
+from fastapi.responses import HTMLResponse, RedirectResponse, StreamingResponse
+from fastapi.encoders import jsonable_encoder
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
 import json
-from PyMultiDictionary import MultiDictionary
+import time
+import os
+from contextlib import asynccontextmanager
+from dictionaries import RemoteDictionary, open_local_dictionary
 from datetime import datetime, timedelta
 
 
-SQLModel.metadata.create_all(engine)
+# Set CREATE_SCHEMA=0 where the schema is managed with migrate.py, so booting workers don't all run DDL
+CREATE_SCHEMA = os.getenv('CREATE_SCHEMA', '1') == '1'
+# Set RUN_SCHEDULER=0 on processes that shouldn't schedule the reminder job
+RUN_SCHEDULER = os.getenv('RUN_SCHEDULER', '1') == '1'
 
-app = FastAPI()
+# Nothing below connects to the database or starts a thread; that's left to lifespan()
+dictionary = RemoteDictionary()
+definition_cache = DefinitionCache()
+dictionary_client = DictionaryClient(dictionary, definition_cache)
+loop_monitor = LoopLagMonitor()
+auth_handler = AuthHandler()
+password_hasher = PasswordHashPool(auth_handler)
+due_cache = DueSummaryCache()
+due_notifier = DueNotifier()
+rendered_pages = RenderedPageCache()
+review_log = ReviewLog()
+review_sessions = ReviewSessions()
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    '''
+    Startup and shutdown work, kept off the import path so that importing the app is quick and side-effect free.
+    Creates any missing tables (unless CREATE_SCHEMA=0), opens the local dictionary and starts the thread pools,
+    the reminder scheduler (unless RUN_SCHEDULER=0), the loop monitor and the review log; shutdown stops them again.
+    '''
+    async_engine = get_async_engine()
+    instrument_engine(get_engine())
+    instrument_engine(async_engine)
+    if CREATE_SCHEMA:
+        async with async_engine.begin() as conn:
+            await conn.run_sync(SQLModel.metadata.create_all)
+    dictionary_client.local = open_local_dictionary()
+    # The thread pools are created here, not on import, and again on every startup since shutdown below stops them
+    dictionary_client.start()
+    password_hasher.start()
+    scheduler = start_email_scheduler() if RUN_SCHEDULER else None
+    loop_monitor.start()
+    review_log.start()
+
+    yield
+
+    await review_log.stop()
+    await loop_monitor.stop()
+    if scheduler is not None:
+        scheduler.shutdown(wait=False)
+    dictionary_client.shutdown()
+    if dictionary_client.local is not None:
+        dictionary_client.local.close()
+        dictionary_client.local = None
+    password_hasher.shutdown()
+    await async_engine.dispose()
+
+
+app = FastAPI(lifespan=lifespan)
+app.add_middleware(MetricsMiddleware)
 app.mount("/static", StaticFiles(directory="static"), name="static") # mount static files
 templates = Jinja2Templates(directory="templates")
 
-dictionary = MultiDictionary()
-auth_handler = AuthHandler()
 
-start_email_scheduler()
+def runtime_stats():
+    '''
+    Stats kept by the loop monitor, the bcrypt pool, the review log, the review sessions and the dictionary client, for /metrics.
+    '''
+    stats = {f'event_loop_{name}': value for name, value in loop_monitor.stats().items()}
+    stats.update({f'password_hash_{name}': value for name, value in password_hasher.stats().items()})
+    stats.update({f'review_log_{name}': value for name, value in review_log.stats().items()})
+    stats.update({
+        'dictionary_fetches': dictionary_client.fetches,
+        'dictionary_coalesced': dictionary_client.coalesced,
+        'dictionary_local_hits': dictionary_client.local_hits,
+        'dictionary_breaker_open': dictionary_client.breaker.is_open,
+        'due_event_connections': due_notifier.connections,
+        'review_sessions': len(review_sessions),
+        'review_sessions_evicted': review_sessions.evicted,
+    })
+    return stats
+
+
+registry.add_collector(runtime_stats)
+
+
+@app.get('/metrics')
+def metrics():
+    return Response(registry.render(), media_type='text/plain; version=0.0.4')
 
 
 @app.exception_handler(HTTP_403_FORBIDDEN)
@@ -47,12 +140,17 @@ def register_form(request: Request):
     return templates.TemplateResponse("register.html", {"request": request})
 
 
+async def find_user(session: AsyncSession, username: str):
+    return (await session.exec(select(User).where(User.username == username))).first()
+
+
 @app.post('/register', status_code=201)
-def register(request: Request, username: str = Form(...), password: str = Form(...), confirm_password: str = Form(...), wants_updates: Optional[bool] = Form(False)):
+async def register(request: Request, username: str = Form(...), password: str = Form(...), confirm_password: str = Form(...), wants_updates: Optional[bool] = Form(False), session: AsyncSession = Depends(get_session)):
     '''
     Passing AuthDetails as the param ensures that the recieved object matches our schema.
     If username is unique, adds new user to users.
     Displays error to user if username or password invalid.
+    Hashing runs on the dedicated bcrypt pool.
     '''
     auth_details = AuthDetails(username=username, password=password)
 
@@ -60,31 +158,28 @@ def register(request: Request, username: str = Form(...), password: str = Form(.
         error = "Passwords don't match"
         return templates.TemplateResponse("register.html", {"request": request, "error": error})
 
+    user = await find_user(session, auth_details.username)
+    if user:
+        error = 'Username already taken'
+        return templates.TemplateResponse("register.html", {"request": request, "error": error})
+    
+    if not validate_email(username):
+        error = 'Invalid email'
+        return templates.TemplateResponse("register.html", {"request": request, "error": error})
 
-    with Session(engine) as session:
-        user = session.exec(select(User).where(User.username == auth_details.username)).first()
-        if user:
-            error = 'Username already taken'
-            return templates.TemplateResponse("register.html", {"request": request, "error": error})
-        
-        if not validate_email(username):
-            error = 'Invalid email'
-            return templates.TemplateResponse("register.html", {"request": request, "error": error})
-
-        
-        letter_missing = not any(ch.isalpha() for ch in password)
-        number_missing = not any(ch.isdigit() for ch in password)
-        special_char_missing = not any(ch in string.punctuation for ch in password)
+    
+    letter_missing = not any(ch.isalpha() for ch in password)
+    number_missing = not any(ch.isdigit() for ch in password)
+    special_char_missing = not any(ch in string.punctuation for ch in password)
 
-        if len(password) < 8 or any([letter_missing, number_missing, special_char_missing]):
-            error = 'Password must be at least 8 characters and contain at least one letter, number and special character'
-            return templates.TemplateResponse("register.html", {"request": request, "error": error})
+    if len(password) < 8 or any([letter_missing, number_missing, special_char_missing]):
+        error = 'Password must be at least 8 characters and contain at least one letter, number and special character'
+        return templates.TemplateResponse("register.html", {"request": request, "error": error})
 
-        hashed_password = auth_handler.get_password_hash(auth_details.password)
+    hashed_password = await password_hasher.hash(auth_details.password)
 
-        user = User(username=auth_details.username, password_hash=hashed_password, wants_updates=wants_updates)
-        session.add(user)
-        session.commit()
+    session.add(User(username=auth_details.username, password_hash=hashed_password, wants_updates=wants_updates))
+    await session.commit()
     return RedirectResponse(url='/login', status_code=303)
 
 
@@ -94,51 +189,70 @@ def login_form(request: Request):
 
 
 @app.post('/login')
-def login(request: Request, username: str = Form(...), password: str = Form(...)):
+async def login(request: Request, username: str = Form(...), password: str = Form(...), session: AsyncSession = Depends(get_session)):
     '''
     Check user exists and retrieve hashed password.
     If user does not exist or password invliad, raise exception.
-    Otherwise, encode token using username and return it.
+    Otherwise, encode token using the user's id and username and return it.
     '''
     auth_details = AuthDetails(username=username, password=password)
 
-    with Session(engine) as session:
-        user = session.exec(select(User).where(User.username == auth_details.username)).first()
-        if (not user) or (not auth_handler.verify_password(auth_details.password, user.password_hash)):
-            error = 'Invalid username and/or password'
-            return templates.TemplateResponse("login.html", {"request": request, "error": error})
-        token = auth_handler.encode_token(user.username)
-
-        response = RedirectResponse(url='/', status_code=303)
-        response.set_cookie(key="access_token", value=f"Bearer {token}", httponly=True)
+    user = await find_user(session, auth_details.username)
+    if (not user) or (not await password_hasher.verify(auth_details.password, user.password_hash)):
+        error = 'Invalid username and/or password'
+        return templates.TemplateResponse("login.html", {"request": request, "error": error})
+    token = auth_handler.encode_token(user)
 
-        auth_handler.decode_token(token)
+    response = RedirectResponse(url='/', status_code=303)
+    response.set_cookie(key="access_token", value=f"Bearer {token}", httponly=True)
 
-        return response
+    return response
 
 
 @app.get('/')
-def index(request: Request, username = Depends(auth_handler.auth_wrapper)):
+def index(request: Request, principal = Depends(auth_handler.auth_wrapper)):
     '''
     Adding a dependency on auth wrapper.
     This is called when endpoint is hit and ensures valid token has been passed in.
     If it passes, index.html is loaded.
     '''
-    return templates.TemplateResponse("index.html", {"request": request, "username": username})
+    return templates.TemplateResponse("index.html", {"request": request, "username": principal.username})
     
 
 @app.post('/logout')
-def logout(response: Response):
+async def logout(request: Request, response: Response):
     '''
-    Invalidate the current token by removing it from the client's cookies.
+    Invalidate the current token by removing it from the client's cookies (and from this worker's verified-token cache).
+    Only this device is logged out; /logout/all ends every session.
     Redirects the user to the login page.
     '''
+    token = request.cookies.get("access_token")
+    if token:
+        auth_handler.forget(token.split(" ")[-1])
+    response.delete_cookie(key="access_token")
+    return {'logged_out': True}
+
+
+@app.post('/logout/all')
+async def logout_everywhere(response: Response, principal = Depends(auth_handler.auth_wrapper)):
+    '''
+    Logs the user out on every device by revoking every token issued to them so far, e.g. after a cookie was copied.
+    '''
+    await auth_handler.revoke_tokens(principal.id)
     response.delete_cookie(key="access_token")
     return {'logged_out': True}
 
 
+def words_changed(user_id: int):
+    '''
+    Called after a user's words change: drops their cached due summary and wakes their /events/due connections.
+    '''
+    due_cache.invalidate(user_id)
+    due_notifier.notify(user_id)
+
+
 @app.post('/lookup')
-async def lookup_word(request: Request, word: str = Form(...), username = Depends(auth_handler.auth_wrapper)):
+async def lookup_word(request: Request, word: str = Form(...), principal = Depends(auth_handler.auth_wrapper), session: AsyncSession = Depends(get_session)):
     '''
     Look up the meaning of the word and add it to the user's word list.
     '''
@@ -146,138 +260,382 @@ async def lookup_word(request: Request, word: str = Form(...), username = Depend
         return {"word": word, "definition": None, "message": "Query must be a single word"}
 
     word = word.title()
-    response = dictionary.meaning('en', word)
 
-    if response[1] == '':
+    # The dictionary (and its cache) are called off the event loop so a slow upstream doesn't stall other requests
+    try:
+        definition = await dictionary_client.lookup(word)
+    except DictionaryUnavailable:
+        return {"word": word, "definition": None, "message": "The dictionary is unavailable, please try again later"}
+
+    if definition is None:
         return {"word": word, "definition": None, "message": f"No results found for '{word}'"}
-    
-    # Tidies the response to show only the grammatical category and definitions.
-    definition = clean_dict(response)
 
-    # Get the user's data
-    with Session(engine) as session:
-        user = session.exec(select(User).where(User.username == username)).first()
+    return await add_word(session, principal.id, word, definition)
 
-        # Check if the word is already in the user's word list
-        existing_word = session.exec(select(Word).where(Word.word == word, Word.user_id == user.id)).first()
-        if existing_word is not None:
-            return {"word": word, "definition": definition, "message": f"'{word}' is already in your list!"}
 
-        # Add the word to the user's word list
-        new_word = Word(word=word, definition=json.dumps(definition), box_number=1, last_reviewed_date=datetime.utcnow(), next_review_date=(datetime.utcnow()+timedelta(days=1)), user_id=user.id)
-        session.add(new_word)
-        session.commit()
+async def add_word(session: AsyncSession, user_id: int, word: str, definition: dict):
+    '''
+    Adds the looked-up word to the user's word list, unless it is already there.
+    Both inserts resolve conflicts in the database, so a double-clicked lookup can't add the word twice.
+    '''
+    insert = insert_for(session.bind)
+
+    # Point the new word at the shared definition rather than storing another copy of it.
+    # The dictionary client has usually stored it already. A word answered by the local dictionary may have no row yet,
+    # or only a cached "no results" one, so the upsert fills in a missing definition but leaves a stored one alone;
+    # in that case (or if another request has just inserted it) nothing comes back and the id is read instead.
+    key = normalise_word(word)
+    new_entry = insert(Definition).values(word=key, definition=json.dumps(definition), fetched_at=datetime.utcnow())
+    new_entry = new_entry.on_conflict_do_update(
+        index_elements=['word'],
+        set_={'definition': new_entry.excluded.definition, 'fetched_at': new_entry.excluded.fetched_at},
+        where=Definition.definition.is_(None)).returning(Definition.id)
+    definition_id = (await session.execute(new_entry)).scalar_one_or_none()
+    if definition_id is None:
+        definition_id = (await session.exec(select(Definition.id).where(Definition.word == key))).one()
+
+    # Add the word to the user's word list; no row comes back if it is already there
+    new_word = insert(Word).values(word=word, definition_id=definition_id, box_number=1, last_reviewed_date=datetime.utcnow(), next_review_date=(datetime.utcnow()+timedelta(days=1)), user_id=user_id)
+    new_word = new_word.on_conflict_do_nothing(index_elements=['user_id', 'word']).returning(Word.id)
+    if (await session.execute(new_word)).first() is None:
+        return {"word": word, "definition": definition, "message": f"'{word}' is already in your list!"}
+
+    events = [review_event(user_id, word, 'added', box_after=1)]
+    await apply_events(session, user_id, events)
+    await bump_version(session, user_id)
+    await session.commit()
+    review_log.record(events)
+    words_changed(user_id)
 
     return {"word": word, "definition": definition, "message": f"'{word}' added to your list!"}
 
 
+@app.post('/import')
+async def import_word_list(file: Optional[UploadFile] = File(None), words: Optional[str] = Form(None), principal = Depends(auth_handler.auth_wrapper)):
+    '''
+    Adds a whole word list (an uploaded CSV/plain-text file, or the same pasted into `words`) to the user's word list.
+    Progress is streamed back as NDJSON, one line per word ('added', 'exists', 'not_found' or 'failed'),
+    followed by a summary line. Lists of more than MAX_IMPORT_WORDS words are turned away.
+    '''
+    if file is not None:
+        text = (await file.read()).decode('utf-8', errors='replace')
+    else:
+        text = words or ''
+    word_list = parse_word_list(text)
+    if not word_list:
+        return {"message": "No words found to import"}
+    if len(word_list) > MAX_IMPORT_WORDS:
+        return {"message": f"The list has {len(word_list)} words; at most {MAX_IMPORT_WORDS} can be imported at once, please split it up"}
+
+    async def progress():
+        async for event in import_words(get_async_engine(), dictionary_client, principal.id, word_list, review_log, on_insert=words_changed):
+            yield json.dumps(event) + '\n'
+
+    return StreamingResponse(progress(), media_type='application/x-ndjson')
+
+
 @app.get('/check')
-def check(username = Depends(auth_handler.auth_wrapper)):
+async def check(request: Request, response: Response, principal = Depends(auth_handler.auth_wrapper), session: AsyncSession = Depends(get_session)):
+    '''
+    Checks whether any words are due for revision, how many, and when the next one will be.
+    Served from the per-user due cache, which only queries the database when the summary has changed.
+    '''
+    version = await get_version(session, principal.id)
+    due_count, next_due = await due_cache.get(session, principal.id, version)
+    etag = make_etag('check', principal.id, version, due_count, next_due)
+    if cached := not_modified(request, etag):
+        return cached
+    set_etag(response, etag)
+    return {'revision_time': due_count > 0, 'due_count': due_count, 'next_due': next_due}
+
+
+async def due_events(user_id: int):
+    '''
+    Yields a server-sent 'due' event with the user's due summary whenever it changes, starting with the current one.
+    In between, the connection sleeps on the due notifier and holds no database connection; it is woken when the
+    user's next word falls due or their words change on this worker, and re-reads the summary every RECHECK_SECONDS
+    in case they changed on another one. Heartbeats send a comment line to keep the connection open.
+    '''
+    last_event = None
+    checked_at = None
+    reason = 'changed'
+    while True:
+        if reason != 'heartbeat' or time.monotonic() - checked_at >= RECHECK_SECONDS:
+            async with AsyncSession(get_async_engine()) as session:
+                version = await get_version(session, user_id)
+                due_count, next_due = await due_cache.get(session, user_id, version)
+            checked_at = time.monotonic()
+            event = json.dumps(jsonable_encoder({'revision_time': due_count > 0, 'due_count': due_count, 'next_due': next_due}))
+            if event != last_event:
+                last_event = event
+                yield f'event: due\ndata: {event}\n\n'
+            else:
+                yield ': keepalive\n\n'
+        else:
+            yield ': keepalive\n\n'
+        reason = await due_notifier.wait(user_id, next_due)
+
+
+@app.get('/events/due')
+def due_event_stream(principal = Depends(auth_handler.auth_wrapper)):
     '''
-    Checks database to see if any words are due for revision.
+    Server-sent events replacing /check polling: pushes the same fields as /check whenever they change.
     '''
-    with Session(engine) as session:
-        user = session.exec(select(User).where(User.username == username)).first()
-        if user:
-            words = session.exec(select(Word).where(Word.user_id == user.id, Word.next_review_date < datetime.utcnow())).all()
-            if words:
-                return {'revision_time': True}
-    return {'revision_time': False}
+    headers = {'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    return StreamingResponse(due_events(principal.id), media_type='text/event-stream', headers=headers)
 
 
 @app.get('/revise', response_class=HTMLResponse)
-def revise(request: Request, username = Depends(auth_handler.auth_wrapper)):
+def revise(request: Request, principal = Depends(auth_handler.auth_wrapper)):
     return templates.TemplateResponse("revise.html", {"request": request})
 
 
+def due_words_query(user_id: int, now: datetime):
+    '''
+    Selects the user's due words along with their shared definitions.
+    '''
+    return (select(Word, Definition.definition)
+        .join(Definition, Word.definition_id == Definition.id, isouter=True)
+        .where(is_due(user_id, now)))
+
+
+def serialise_word(word: Word, definition: Optional[str]):
+    word_dict = word.dict(exclude={'definition_id'})
+    word_dict['definition'] = json.loads(definition) if definition else None
+    return word_dict
+
+
+async def stream_due_words(user_id: int, now: datetime):
+    '''
+    Yields every due word as a line of JSON, fetching one page at a time so memory stays flat.
+    Each page uses its own short session, so a slow client never holds a connection between pages.
+    '''
+    cursor = None
+    while True:
+        async with AsyncSession(get_async_engine()) as session:
+            rows = (await session.exec(paginate(due_words_query(user_id, now), cursor, MAX_PAGE_SIZE))).all()
+        page, cursor = split_page(rows, MAX_PAGE_SIZE, key=lambda row: row[0])
+        for word, definition in page:
+            yield json.dumps(jsonable_encoder(serialise_word(word, definition))) + '\n'
+        if cursor is None:
+            return
+
+
 @app.get('/getwords')
-def getwords(username = Depends(auth_handler.auth_wrapper)):
+async def getwords(request: Request, response: Response, cursor: Optional[str] = None, limit: Optional[int] = None, principal = Depends(auth_handler.auth_wrapper), session: AsyncSession = Depends(get_session)):
+    '''
+    Returns one page of the words that the user is due to revise, with the cursor for the next page.
+    The first page also includes the total number of due words.
+    Clients that accept application/x-ndjson get every due word streamed instead.
+    Between changes to the user's words, the due set only grows as time passes, so the vocabulary version
+    and the due count together identify the page; if the client already has it, a 304 is returned without querying.
+    '''
+    now = datetime.utcnow()
+    if 'application/x-ndjson' in request.headers.get('accept', ''):
+        return StreamingResponse(stream_due_words(principal.id, now), media_type='application/x-ndjson')
+
+    version = await get_version(session, principal.id)
+    due_count, _ = await due_cache.get(session, principal.id, version)
+    etag = make_etag('getwords', principal.id, version, due_count, cursor, limit)
+    if cached := not_modified(request, etag):
+        return cached
+
+    rows = (await session.exec(paginate(due_words_query(principal.id, now), cursor, limit))).all()
+    page, next_cursor = split_page(rows, limit, key=lambda row: row[0])
+    words_page = {'words': [serialise_word(word, definition) for word, definition in page], 'next_cursor': next_cursor}
+    if not cursor:
+        words_page['due_count'] = due_count
+    set_etag(response, etag)
+    return words_page
+
+
+@app.get('/review/next')
+async def review_next(start: bool = False, size: Optional[int] = None, exclude: List[int] = Query(default=[]), principal = Depends(auth_handler.auth_wrapper), session: AsyncSession = Depends(get_session)):
     '''
-    Returns from the database all words that username is due to revise.
+    Hands out the next few of the user's due words, most overdue first (see review_queue.py); an empty list means the session is over.
+    start=true begins a new review session, as the revise page does when it loads.
+    exclude lists the ids of words the client already holds, so a session started on another worker doesn't hand them out again.
+    remaining is how many more words are queued, and due_count how many the session has had in all.
     '''
-    with Session(engine) as session:
-        user = session.exec(select(User).where(User.username == username)).first()
-        if user:
-            words = session.exec(select(Word).where(Word.user_id == user.id, Word.next_review_date < datetime.utcnow())).all()
-    return {'words': [word.dict() for word in words]}
+    review_session = review_sessions.get(principal.id, restart=start, exclude=exclude)
+    size = min(max(size or REVIEW_BATCH_SIZE, 1), MAX_REVIEW_BATCH_SIZE)
+    batch = await review_session.next_batch(session, size)
+    return {
+        'words': [serialise_word(word, definition) for word, definition in batch],
+        'remaining': review_session.remaining,
+        'due_count': review_session.due_count,
+    }
 
 
 @app.post('/update')
-def update(word_details: WordDetails):
+async def update(word_details: WordDetails, principal = Depends(auth_handler.auth_wrapper), session: AsyncSession = Depends(get_session)):
     # Update database with new box_number, last_reviewed_date and next_review_date based on spaced-repetition algo 'update_box()'
     new_box, last_reviewed_date, next_review_date = update_box(word_details.current_box, word_details.is_correct)
 
-    with Session(engine) as session:
-        word_obj = session.exec(select(Word).where(Word.user_id == word_details.user_id, Word.word == word_details.word)).first()
-        if word_obj is not None:
-            word_obj.box_number = new_box
-            word_obj.last_reviewed_date = last_reviewed_date
-            word_obj.next_review_date = next_review_date
-            session.add(word_obj)
-            session.commit()
+    # The UPDATE only matches while the word is still in the box the client saw, so in the usual case one
+    # statement both moves the word and tells the stats which box it left. If the client was out of date,
+    # the stored box is read and the UPDATE retried against it.
+    box_before = word_details.current_box
+    while box_before is not None:
+        statement = (update_rows(Word)
+                     .where(Word.user_id == principal.id, Word.word == word_details.word, Word.box_number == box_before)
+                     .values(box_number=new_box, last_reviewed_date=last_reviewed_date, next_review_date=next_review_date)
+                     .returning(Word.id)
+                     .execution_options(synchronize_session=False))
+        if (await session.execute(statement)).first() is not None:
+            break
+        box_before = (await session.exec(select(Word.box_number).where(Word.user_id == principal.id, Word.word == word_details.word))).first()
+    if box_before is not None:
+        events = [review_event(principal.id, word_details.word, 'reviewed', box_before, new_box, word_details.is_correct)]
+        await apply_events(session, principal.id, events)
+        await bump_version(session, principal.id)
+        await session.commit()
+        review_log.record(events)
+        words_changed(principal.id)
     return
 
-@app.get('/words', response_class=HTMLResponse)
-def words(request: Request, username = Depends(auth_handler.auth_wrapper)):
+
+@app.post('/updatebatch')
+async def update_batch(batch: WordDetailsBatch, principal = Depends(auth_handler.auth_wrapper), session: AsyncSession = Depends(get_session)):
+    '''
+    Applies 'update_box()' to many review results at once, e.g. everything answered since the client last flushed.
+    The new boxes and dates are computed together by scheduling.update_boxes and written with one bulk UPDATE in a single transaction.
+    Results for words the user doesn't own, or with an impossible box number, are rejected and returned.
+    '''
+    rejected = [details.word for details in batch.words if details.user_id != principal.id]
+    # If a word was answered more than once, its latest answer wins
+    results = {details.word: details for details in batch.words if details.user_id == principal.id}
+
+    # word -> (id, box it's in now)
+    owned = {word: (id, box) for word, id, box in (await session.exec(select(Word.word, Word.id, Word.box_number).where(Word.user_id == principal.id, Word.word.in_(results)))).all()}
+
+    answered = []
+    for word, details in results.items():
+        if word not in owned or not 1 <= details.current_box <= MAX_BOX:
+            rejected.append(word)
+            continue
+        answered.append(details)
+
+    new_boxes, last_reviewed_date, next_review_dates = update_boxes([details.current_box for details in answered], [details.is_correct for details in answered])
+    rows = []
+    events = []
+    for details, new_box, next_review_date in zip(answered, new_boxes.tolist(), next_review_dates.tolist()):
+        rows.append({'id': owned[details.word][0], 'box_number': new_box, 'last_reviewed_date': last_reviewed_date, 'next_review_date': next_review_date})
+        events.append(review_event(principal.id, details.word, 'reviewed', owned[details.word][1], new_box, details.is_correct))
+
+    if rows:
+        await session.execute(update_rows(Word), rows)
+        await apply_events(session, principal.id, events)
+        await bump_version(session, principal.id)
+        await session.commit()
+        review_log.record(events)
+        words_changed(principal.id)
+
+    return {'updated': len(rows), 'rejected': rejected}
+
+async def word_list_page(session: AsyncSession, user_id: int, cursor: Optional[str] = None, limit: Optional[int] = None):
+    '''
+    Returns (one page of the user's words formatted for the word list, the cursor for the next page).
+    Times are sent as UTC timestamps and shown relative to now by words_script.js, so a rendered page
+    only changes when the user's words do.
+    '''
+    words = (await session.exec(paginate(select(Word).where(Word.user_id == user_id), cursor, limit))).all()
+    words, next_cursor = split_page(words, limit)
+
     words_list = []
-    with Session(engine) as session:
-        user = session.exec(select(User).where(User.username == username)).first()
-        if user:
-            words = session.exec(select(Word)
-                .where(Word.user_id == user.id)
-                .order_by(Word.next_review_date, (Word.last_reviewed_date))
-                ).all()
-            
-            for word in words:
-                last_reviewed = days_hours_mins(datetime.utcnow(), word.last_reviewed_date, is_last=True)
-                next_review = days_hours_mins(word.next_review_date, datetime.utcnow())
-
-                words_list.append({
-                    'word': word.word,
-                    'box_number': word.box_number,
-                    'last_reviewed': last_reviewed,
-                    'next_review': next_review
-                })
-            
-    return templates.TemplateResponse("words.html", {"request": request, "words": words_list})
+    for word in words:
+        words_list.append({
+            'word': word.word,
+            'box_number': word.box_number,
+            'last_reviewed': word.last_reviewed_date.isoformat() + 'Z',
+            'next_review': word.next_review_date.isoformat() + 'Z'
+        })
+    return words_list, next_cursor
+
+
+@app.get('/words', response_class=HTMLResponse)
+async def words(request: Request, principal = Depends(auth_handler.auth_wrapper), session: AsyncSession = Depends(get_session)):
+    '''
+    Renders the first page of the word list; the rest is loaded from '/words/page' as the user scrolls.
+    The rendered page is cached per vocabulary version, and not sent at all if the client already has it.
+    '''
+    version = await get_version(session, principal.id)
+    etag = make_etag('words', principal.id, version)
+    if cached := not_modified(request, etag):
+        return cached
+
+    page = rendered_pages.get(principal.id, version)
+    if page is None:
+        words_list, next_cursor = await word_list_page(session, principal.id)
+        page = templates.get_template("words.html").render({"request": request, "words": words_list, "next_cursor": next_cursor})
+        rendered_pages.put(principal.id, version, page)
+    return set_etag(HTMLResponse(page), etag)
+
+
+@app.get('/words/page')
+async def words_page(cursor: str, limit: Optional[int] = None, principal = Depends(auth_handler.auth_wrapper), session: AsyncSession = Depends(get_session)):
+    words_list, next_cursor = await word_list_page(session, principal.id, cursor, limit)
+    return {'words': words_list, 'next_cursor': next_cursor}
 
 
 @app.post('/delete')
-def delete(word: DeleteWord, username = Depends(auth_handler.auth_wrapper)):
-   with Session(engine) as session:
-       user = session.exec(select(User).where(User.username == username)).first()
-       if user:
-           word_to_delete = session.exec(select(Word).where(Word.word == word.word, Word.user_id == user.id)).first()
-           if word_to_delete:
-               session.delete(word_to_delete)
-               session.commit()
-               return {'delete_successful': True, 'error': None}
-           else:
-               return {'delete_successful': False, 'error': 'Word not found'}
-       else:
-           return {'delete_successful': False, 'error': 'User not found'}
+async def delete(word: DeleteWord, principal = Depends(auth_handler.auth_wrapper), session: AsyncSession = Depends(get_session)):
+   statement = delete_rows(Word).where(Word.word == word.word, Word.user_id == principal.id).returning(Word.box_number).execution_options(synchronize_session=False)
+   box_before = (await session.execute(statement)).scalar_one_or_none()
+   if box_before is not None:
+       events = [review_event(principal.id, word.word, 'deleted', box_before=box_before)]
+       await apply_events(session, principal.id, events)
+       await bump_version(session, principal.id)
+       await session.commit()
+       review_log.record(events)
+       words_changed(principal.id)
+       return {'delete_successful': True, 'error': None}
+   else:
+       return {'delete_successful': False, 'error': 'Word not found'}
        
 
+@app.get('/stats')
+async def stats(request: Request, response: Response, principal = Depends(auth_handler.auth_wrapper), session: AsyncSession = Depends(get_session)):
+    '''
+    Returns the user's word counts per box, accuracy, streaks and reviews for each of the last 30 days.
+    These are kept up to date as the words change (see stats.py), so this costs the same however many words the user has.
+    '''
+    version = await get_version(session, principal.id)
+    # The streak and the last 30 days also move on at midnight
+    today = datetime.utcnow().date()
+    etag = make_etag('stats', principal.id, version, today)
+    if cached := not_modified(request, etag):
+        return cached
+
+    set_etag(response, etag)
+    return await read_stats(session, principal.id, today)
+
+
 @app.get('/emailpreference')
-def words(request: Request, username = Depends(auth_handler.auth_wrapper)):
-    with Session(engine) as session:
-        user = session.exec(select(User).where(User.username == username)).first()
-        if user:
-            preference = user.wants_updates
-            return {'preference': preference, 'error': None}
-        return {'preference': preference, 'error': 'No user found'}
+async def email_preference(request: Request, response: Response, principal = Depends(auth_handler.auth_wrapper), session: AsyncSession = Depends(get_session)):
+    version = await get_version(session, principal.id)
+    etag = make_etag('emailpreference', principal.id, version)
+    if cached := not_modified(request, etag):
+        return cached
+
+    user = await session.get(User, principal.id)
+    if user:
+        preference = user.wants_updates
+        set_etag(response, etag)
+        return {'preference': preference, 'error': None}
+    return {'preference': None, 'error': 'No user found'}
         
 
 @app.post('/changepreference')
-def change_preference(username = Depends(auth_handler.auth_wrapper)):
-   with Session(engine) as session:
-       user = session.exec(select(User).where(User.username == username)).first()
-       if user:
-           old_preference = user.wants_updates
-           new_preference = not old_preference
-           user.wants_updates = new_preference
-           session.add(user)
-           session.commit()
-           return {'change_successful': True, 'error': None}
-       else:
-           return {'change_successful': False, 'error': 'USer not found'}
\ No newline at end of file
+async def change_preference(principal = Depends(auth_handler.auth_wrapper), session: AsyncSession = Depends(get_session)):
+   # Flips the flag and bumps the vocab version (see bump_version()) in place, in one statement
+   statement = (update_rows(User)
+                .where(User.id == principal.id)
+                .values(wants_updates=not_(User.wants_updates), vocab_version=User.vocab_version + 1)
+                .returning(User.wants_updates)
+                .execution_options(synchronize_session=False))
+   if (await session.execute(statement)).first() is not None:
+       await session.commit()
+       return {'change_successful': True, 'error': None}
+   else:
+       return {'change_successful': False, 'error': 'USer not found'}
\ No newline at end of file
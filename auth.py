@@ -3,6 +3,15 @@ from fastapi import HTTPException, Security, Request
 from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer # Delete
 from passlib.context import CryptContext
 from datetime import datetime, timedelta
+from collections import OrderedDict
+from typing import NamedTuple
+from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
+from sqlalchemy import update
+from models import User
+from database import get_async_engine
+from hashing import BCRYPT_ROUNDS
+import threading
 import os
 
 '''
@@ -19,11 +28,30 @@ CryptContext creates context for hashing and validating passwords.
 Datetimw used for setting issue and expiry times of the jwt.
 '''
 
+# Verified tokens (and users' token versions) are trusted for this long before being checked again, so a revocation made on another worker applies within it
+TOKEN_CACHE_TTL = timedelta(seconds=int(os.getenv('TOKEN_CACHE_TTL_SECONDS', 300)))
+TOKEN_CACHE_SIZE = int(os.getenv('TOKEN_CACHE_SIZE', 10000))
+
+
+class Principal(NamedTuple):
+    '''
+    The authenticated user, as carried in the token; endpoints use it instead of looking the user up.
+    '''
+    id: int
+    username: str
+    token_version: int
+
+
 class AuthHandler():
     # security = HTTPBearer()
-    pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+    pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=BCRYPT_ROUNDS)
     secret = os.getenv('JWT_SECRET')
 
+    def __init__(self):
+        self._verified = OrderedDict() # token -> (Principal, trusted_until)
+        self._versions = {} # user id -> (latest token version this worker knows of, when to read it again)
+        self._lock = threading.Lock()
+
     def get_password_hash(self, password):
         '''
         Takes a plain text password and returns its securely hashed representation using CryptContext.
@@ -36,16 +64,19 @@ class AuthHandler():
         '''
         return self.pwd_context.verify(plain_password, hashed_password)
     
-    def encode_token(self, user_id):
+    def encode_token(self, user: User):
         '''
-        Takes a user ID and generates a JSON Web Token (JWT) for authentication.
-        The token includes an expiration time, an issued at time, and the user ID as the subject.
+        Takes a user and generates a JSON Web Token (JWT) for authentication.
+        The token includes an expiration time, an issued at time, the user ID as the subject,
+        the username and the user's token version (bumped by revoke_tokens to invalidate older tokens).
         Returns the encoded token as a string.
         '''
         payload = {
             'exp': datetime.utcnow() + timedelta(days=1),
             'iat': datetime.utcnow(),
-            'sub': user_id
+            'sub': str(user.id),
+            'name': user.username,
+            'ver': user.token_version
         }
         return jwt.encode(
             payload,
@@ -55,28 +86,96 @@ class AuthHandler():
     
     def decode_token(self, token):
         '''
-        Takes a token and decodes it to extract the subject (user ID).
-        If the token is valid, returns the user ID.
+        Takes a token and decodes it to extract the Principal (user ID, username and token version).
+        If the token is valid, returns the Principal.
         If the token has expired, raises an HTTPException with a 401 unauthorised status code and an expired signature error message.
         If the token is invalid, raises an HTTPException with a 401 unauthorised status code and an invalid token error message.
         '''
         try:
             payload = jwt.decode(token, self.secret, algorithms='HS256')
-            return payload['sub']
+            return Principal(int(payload['sub']), payload['name'], payload['ver']), datetime.utcfromtimestamp(payload['exp'])
         except jwt.ExpiredSignatureError:
             raise HTTPException(status_code=401, detail='Signature has expired')
-        except jwt.InvalidTokenError as e:
+        except (jwt.InvalidTokenError, KeyError, ValueError) as e:
+            # Tokens issued before ids were carried in them are rejected too, so those users simply log in again
             raise HTTPException(status_code=401, detail='Invalid token')
-        
-    def auth_wrapper(self, request: Request):
+
+    async def _current_version(self, user_id: int):
+        '''
+        Returns the user's current token version, from this worker's memory if it was read within TOKEN_CACHE_TTL,
+        otherwise from the database, so that revocations made on other workers are picked up.
+        '''
+        now = datetime.utcnow()
+        with self._lock:
+            entry = self._versions.get(user_id)
+        if entry is not None and now < entry[1]:
+            return entry[0]
+        async with AsyncSession(get_async_engine()) as session:
+            version = (await session.exec(select(User.token_version).where(User.id == user_id))).first()
+        if version is None:
+            return None
+        with self._lock:
+            self._versions[user_id] = (version, now + TOKEN_CACHE_TTL)
+        return version
+
+    async def verify(self, token):
+        '''
+        Returns the Principal for a token, using the verified-token cache where possible.
+        Only a token seen for the first time (or whose cache entry expired) pays for signature verification
+        and the token version check.
+        '''
+        now = datetime.utcnow()
+        with self._lock:
+            entry = self._verified.get(token)
+            if entry is not None:
+                principal, trusted_until = entry
+                if now < trusted_until and principal.token_version >= self._versions.get(principal.id, (0, None))[0]:
+                    self._verified.move_to_end(token)
+                    return principal
+                del self._verified[token]
+
+        principal, expires_at = self.decode_token(token)
+        version = await self._current_version(principal.id)
+        if version is None or principal.token_version < version:
+            raise HTTPException(status_code=401, detail='Token has been revoked')
+
+        with self._lock:
+            self._verified[token] = (principal, min(expires_at, now + TOKEN_CACHE_TTL))
+            while len(self._verified) > TOKEN_CACHE_SIZE:
+                self._verified.popitem(last=False)
+        return principal
+
+    def forget(self, token):
+        '''
+        Drops a token from the verified-token cache, e.g. when its cookie is deleted at logout.
+        '''
+        with self._lock:
+            self._verified.pop(token, None)
+
+    async def revoke_tokens(self, user_id: int):
+        '''
+        Invalidates every token issued to the user so far by bumping their token version.
+        Takes effect immediately on this worker and within TOKEN_CACHE_TTL on the others.
+        '''
+        async with AsyncSession(get_async_engine()) as session:
+            await session.execute(update(User).where(User.id == user_id).values(token_version=User.token_version + 1))
+            await session.commit()
+            version = (await session.exec(select(User.token_version).where(User.id == user_id))).first()
+        with self._lock:
+            self._versions[user_id] = (version, datetime.utcnow() + TOKEN_CACHE_TTL)
+            for token in [token for token, (principal, _) in self._verified.items() if principal.id == user_id]:
+                del self._verified[token]
+
+    async def auth_wrapper(self, request: Request):
         '''
         This function wraps the authentication process.
         It ensures that a valid bearer token is present in the authorization header of the request.
-        If the token is present and valid, it returns the user ID extracted from the token.
+        If the token is present and valid, it returns the Principal extracted from the token.
+        It runs on the event loop: a cached token needs no I/O, and a cache miss reads the token version through the async engine.
         '''
         token = request.cookies.get("access_token")
         if not token:
             raise HTTPException(status_code=403, detail="Not authenticated")
-        return self.decode_token(token.split(" ")[1]) # omitting "Bearer "
+        return await self.verify(token.split(" ")[1]) # omitting "Bearer "
     
         # return self.decode_token(auth.credentials)
\ No newline at end of file
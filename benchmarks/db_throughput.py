@@ -0,0 +1,83 @@
+'''
+Compares database-bound request throughput for the old synchronous sessions (one threadpool thread held
+per query) against the async data layer in database.py.
+
+    python benchmarks/db_throughput.py --requests 2000 --concurrency 100
+    DATABASE_URL=postgresql://... python benchmarks/db_throughput.py
+
+Without DATABASE_URL, a temporary SQLite file is used. The query is the one behind /check and /getwords.
+'''
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DATABASE_URL', f'sqlite:///{tempfile.mkdtemp()}/bench.db')
+
+from sqlalchemy import func
+from sqlmodel import SQLModel, Session, select
+from sqlmodel.ext.asyncio.session import AsyncSession
+from starlette.concurrency import run_in_threadpool
+from models import User, Word
+from database import get_engine, get_async_engine
+from due import is_due
+
+
+def seed(n_users: int, words_per_user: int):
+    SQLModel.metadata.create_all(get_engine())
+    now = datetime.utcnow()
+    with Session(get_engine()) as session:
+        if session.exec(select(func.count(User.id))).one() >= n_users:
+            return
+        users = [User(username=f'bench{i}@example.com', password_hash='x', wants_updates=False) for i in range(n_users)]
+        session.add_all(users)
+        session.flush()
+        for user in users:
+            session.add_all(Word(word=f'Word{j}', box_number=j % 10 + 1, last_reviewed_date=now,
+                                 next_review_date=now + timedelta(hours=j - words_per_user // 2), user_id=user.id)
+                            for j in range(words_per_user))
+        session.commit()
+
+
+def sync_request(user_id: int):
+    with Session(get_engine()) as session:
+        return session.exec(select(func.count(Word.id)).where(is_due(user_id, datetime.utcnow()))).one()
+
+
+async def async_request(user_id: int):
+    async with AsyncSession(get_async_engine()) as session:
+        return (await session.exec(select(func.count(Word.id)).where(is_due(user_id, datetime.utcnow())))).one()
+
+
+async def drive(handler, n_requests: int, concurrency: int, n_users: int):
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one(i):
+        async with semaphore:
+            await handler(i % n_users + 1)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(n_requests)))
+    return n_requests / (time.perf_counter() - started)
+
+
+async def main(args):
+    seed(args.users, args.words)
+    before = await drive(lambda user_id: run_in_threadpool(sync_request, user_id), args.requests, args.concurrency, args.users)
+    after = await drive(async_request, args.requests, args.concurrency, args.users)
+    await get_async_engine().dispose()
+    print(f'sync sessions on threadpool: {before:8.1f} req/s')
+    print(f'async sessions:              {after:8.1f} req/s')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--concurrency', type=int, default=100)
+    parser.add_argument('--users', type=int, default=50)
+    parser.add_argument('--words', type=int, default=200)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,87 @@
+'''
+Compares lookup latency of the local (memory-mapped) and remote (scraped) dictionary backends.
+
+    python benchmarks/dictionary_backends.py --dictionary dictionary.bin --remote-words 20
+    python benchmarks/dictionary_backends.py --entries 150000 --stub-latency 0.4
+
+Without --dictionary, a dictionary file with --entries synthetic words is built in a temporary directory.
+The remote backend scrapes the real site unless --stub-latency is given, in which case it is replaced
+by a stub that sleeps for that long, so the benchmark can run without network access.
+'''
+import argparse
+import os
+import random
+import string
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DATABASE_URL', 'sqlite://')
+
+from dictionaries import LocalDictionary, RemoteDictionary, build_dictionary
+from stubs import StubScraper
+
+
+def synthetic_entries(count: int, seed: int = 0):
+    rng = random.Random(seed)
+    entries = {}
+    while len(entries) < count:
+        word = ''.join(rng.choice(string.ascii_lowercase) for _ in range(rng.randint(3, 12)))
+        entries[word] = {'Noun': [f'a synthetic definition of {word}', 'a second, slightly longer synthetic definition']}
+    return entries
+
+
+def percentile(samples: list, fraction: float):
+    ordered = sorted(samples)
+    return ordered[min(int(len(ordered) * fraction), len(ordered) - 1)]
+
+
+def measure(backend, words: list):
+    timings = []
+    hits = 0
+    for word in words:
+        started = time.perf_counter()
+        definition = backend.define(word)
+        timings.append(time.perf_counter() - started)
+        hits += definition is not None
+    return timings, hits
+
+
+def report(name: str, timings: list, hits: int):
+    print(f'{name:>7}: {len(timings)} lookups, {hits} found, '
+          f'mean {sum(timings) / len(timings) * 1000:.3f} ms, '
+          f'p50 {percentile(timings, 0.5) * 1000:.3f} ms, '
+          f'p99 {percentile(timings, 0.99) * 1000:.3f} ms')
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--dictionary', help='existing dictionary file built with dictionaries.py')
+    parser.add_argument('--entries', type=int, default=150000, help='synthetic entries to build when --dictionary is not given')
+    parser.add_argument('--local-words', type=int, default=100000)
+    parser.add_argument('--remote-words', type=int, default=20)
+    parser.add_argument('--stub-latency', type=float, default=None)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = args.dictionary
+        if path is None:
+            path = os.path.join(directory, 'dictionary.bin')
+            started = time.perf_counter()
+            build_dictionary(synthetic_entries(args.entries), path)
+            print(f'Built {args.entries} entries in {time.perf_counter() - started:.2f}s ({os.path.getsize(path) / 1e6:.1f} MB)')
+
+        local = LocalDictionary(path)
+        # Look up real keys, plus some misses, which cost a full binary search
+        keys = [local._key(random.randrange(len(local))).decode() for _ in range(args.local_words)]
+        keys += ['zzzz' + key for key in keys[:len(keys) // 10]]
+        report('local', *measure(local, keys))
+
+        remote = RemoteDictionary(StubScraper(args.stub_latency) if args.stub_latency is not None else None)
+        report('remote', *measure(remote, keys[:args.remote_words]))
+        local.close()
+
+
+if __name__ == '__main__':
+    main()
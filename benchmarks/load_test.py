@@ -0,0 +1,303 @@
+'''
+Load-tests the whole app in-process: seeds a SQLite database, then drives the revision cycle through the
+real FastAPI app with a stub dictionary and a stub email transport, so no network, Postgres or Mailjet is needed.
+
+    python benchmarks/load_test.py --users 200 --words 100
+    python benchmarks/load_test.py --database :memory: --scenarios lookup,check --compare benchmarks/results/<earlier run>.json
+
+Scenarios:
+    auth       a burst of registrations, then a burst of logins
+    lookup     /lookup storms over a shared vocabulary, so some words repeat across users
+    check      /check polling
+    review     /review/next sessions, answering every word and flushing answers to /updatebatch a batch at a time like revise_script.js
+    words      /words browsing, following /words/page cursors
+    reminders  one email_if_revision_due run
+
+Each scenario reports throughput, latency percentiles and database queries per request.
+Results are written to benchmarks/results/ as JSON; --compare prints the change against an earlier run.
+Requires httpx, which the app itself doesn't need.
+'''
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from stubs import StubScraper
+
+SCENARIOS = ['auth', 'lookup', 'check', 'review', 'words', 'reminders']
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results')
+PASSWORD = 'benchmark-1!'
+
+
+def configure(args):
+    '''
+    Points the app at the benchmark database before anything imports it.
+    '''
+    if args.database == ':memory:':
+        # The app's sync and async engines need to share one database, and a shared-cache in-memory database
+        # fails concurrent writes with 'table is locked', so use a file on a RAM-backed filesystem instead
+        directory = '/dev/shm' if os.path.isdir('/dev/shm') else None
+        path = os.path.join(tempfile.mkdtemp(dir=directory), 'bench.db')
+    else:
+        path = args.database or os.path.join(tempfile.mkdtemp(), 'bench.db')
+    os.environ['DATABASE_URL'] = f'sqlite:///{path}'
+    os.environ.setdefault('JWT_SECRET', 'benchmark-secret-not-for-production-use')
+    os.environ['EMAIL_BACKEND'] = 'stub'
+    os.environ['BCRYPT_ROUNDS'] = str(args.bcrypt_rounds)
+    # The reminders scenario runs the job itself
+    os.environ['RUN_SCHEDULER'] = '0'
+
+
+def seed(n_users: int, words_per_user: int, due_fraction: float):
+    '''
+    Adds n_users opted-in users with words_per_user words each, spread over boxes 1-10, about due_fraction of them due.
+    Returns the users.
+    '''
+    from sqlalchemy import insert
+    from sqlmodel import Session, select
+    from models import User, Word, Definition
+    from database import get_engine
+    from auth import AuthHandler
+
+    now = datetime.utcnow()
+    rng = random.Random(0)
+    password_hash = AuthHandler().get_password_hash(PASSWORD)
+    with Session(get_engine()) as session:
+        session.execute(insert(User), [{'username': f'seed{i}@example.com', 'password_hash': password_hash, 'wants_updates': True} for i in range(n_users)])
+        session.execute(insert(Definition), [{'word': f'seedword{j}', 'definition': json.dumps({'Noun ': [f'definition {j}']}), 'fetched_at': now} for j in range(words_per_user)])
+        users = session.exec(select(User)).all()
+        definitions = session.exec(select(Definition.id)).all()
+        rows = []
+        for user in users:
+            for j, definition_id in enumerate(definitions):
+                box = j % 10 + 1
+                due = rng.random() < due_fraction
+                rows.append({
+                    'word': f'Seedword{j}',
+                    'definition_id': definition_id,
+                    'box_number': box,
+                    'last_reviewed_date': now - timedelta(days=box),
+                    'next_review_date': now - timedelta(hours=rng.randint(1, 48)) if due else now + timedelta(days=rng.randint(1, 56)),
+                    'user_id': user.id,
+                })
+        for start in range(0, len(rows), 5000):
+            session.execute(insert(Word), rows[start:start + 5000])
+        session.commit()
+        users = session.exec(select(User)).all()
+        session.expunge_all()
+    return users
+
+
+def percentile(samples: list, fraction: float):
+    ordered = sorted(samples)
+    return ordered[min(int(len(ordered) * fraction), len(ordered) - 1)] if ordered else 0.0
+
+
+class Recorder():
+    '''
+    Collects request latencies and status codes for one scenario.
+    '''
+
+    def __init__(self):
+        self.latencies = []
+        self.errors = 0
+
+    async def request(self, client, method: str, url: str, **kwargs):
+        started = time.perf_counter()
+        response = await client.request(method, url, **kwargs)
+        self.latencies.append(time.perf_counter() - started)
+        if response.status_code >= 400:
+            self.errors += 1
+        return response
+
+
+async def run_concurrently(jobs: list, concurrency: int):
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def run(job):
+        async with semaphore:
+            await job()
+
+    await asyncio.gather(*(run(job) for job in jobs))
+
+
+def client_for(app, token: str = None):
+    import httpx
+    cookies = {'access_token': f'Bearer {token}'} if token else None
+    return httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url='http://bench', cookies=cookies)
+
+
+async def scenario_auth(app, users, recorder, args):
+    async with client_for(app) as client:
+        await run_concurrently([lambda i=i: recorder.request(client, 'POST', '/register', data={
+            'username': f'new{i}-{time.time_ns()}@example.com', 'password': PASSWORD, 'confirm_password': PASSWORD,
+        }) for i in range(args.requests // 2)], args.concurrency)
+        await run_concurrently([lambda user=user: recorder.request(client, 'POST', '/login', data={
+            'username': user.username, 'password': PASSWORD,
+        }) for user in random.choices(users, k=args.requests // 2)], args.concurrency)
+
+
+async def scenario_lookup(app, users, recorder, args, tokens):
+    vocabulary = [f'Lookup{i}' for i in range(max(args.requests // 4, 1))]
+    jobs = []
+    for _ in range(args.requests):
+        user = random.choice(users)
+        jobs.append(lambda user=user, word=random.choice(vocabulary): lookup(app, tokens[user.id], word, recorder))
+    await run_concurrently(jobs, args.concurrency)
+
+
+async def lookup(app, token, word, recorder):
+    async with client_for(app, token) as client:
+        await recorder.request(client, 'POST', '/lookup', data={'word': word})
+
+
+async def scenario_check(app, users, recorder, args, tokens):
+    async def poll(user):
+        async with client_for(app, tokens[user.id]) as client:
+            await recorder.request(client, 'GET', '/check')
+    await run_concurrently([lambda user=user: poll(user) for user in random.choices(users, k=args.requests)], args.concurrency)
+
+
+async def scenario_review(app, users, recorder, args, tokens):
+    async def review(user):
+        async with client_for(app, tokens[user.id]) as client:
+            params = {'start': 'true'}
+            while True:
+                batch = (await recorder.request(client, 'GET', '/review/next', params=params)).json()
+                if not batch['words']:
+                    break
+                answers = [{'word': word['word'], 'user_id': user.id, 'current_box': word['box_number'], 'is_correct': random.random() < 0.7} for word in batch['words']]
+                await recorder.request(client, 'POST', '/updatebatch', json={'words': answers})
+                params = {}
+    await run_concurrently([lambda user=user: review(user) for user in random.sample(users, min(len(users), args.sessions))], args.concurrency)
+
+
+async def scenario_words(app, users, recorder, args, tokens):
+    async def browse(user):
+        async with client_for(app, tokens[user.id]) as client:
+            response = await recorder.request(client, 'GET', '/words')
+            cursor = response.text.split('data-next-cursor="', 1)[1].split('"', 1)[0] if 'data-next-cursor="' in response.text else None
+            while cursor:
+                cursor = (await recorder.request(client, 'GET', '/words/page', params={'cursor': cursor})).json().get('next_cursor')
+    await run_concurrently([lambda user=user: browse(user) for user in random.sample(users, min(len(users), args.sessions))], args.concurrency)
+
+
+async def scenario_reminders(app, users, recorder, args):
+    from helpers import email_if_revision_due
+    from mailer import StubTransport
+    transport = StubTransport(args.email_latency)
+    started = time.perf_counter()
+    await asyncio.get_running_loop().run_in_executor(None, email_if_revision_due, transport)
+    recorder.latencies.append(time.perf_counter() - started)
+    return {'emails': transport.messages, 'batches': transport.batches}
+
+
+async def run_scenarios(args):
+    import app as appmod
+    from sqlmodel import SQLModel
+    from database import get_engine
+    from dictionaries import RemoteDictionary
+    from metrics import QUERIES
+
+    SQLModel.metadata.create_all(get_engine())
+    appmod.dictionary_client.dictionary = RemoteDictionary(StubScraper(args.dictionary_latency))
+
+    started = time.perf_counter()
+    users = seed(args.users, args.words, args.due_fraction)
+    print(f'Seeded {args.users} users x {args.words} words in {time.perf_counter() - started:.1f}s')
+    tokens = {user.id: appmod.auth_handler.encode_token(user) for user in users}
+
+    results = {}
+    async with appmod.app.router.lifespan_context(appmod.app):
+        for name in args.scenarios:
+            recorder = Recorder()
+            scenario = globals()[f'scenario_{name}']
+            queries_before = QUERIES.value()
+            started = time.perf_counter()
+            if name in ('auth', 'reminders'):
+                extra = await scenario(appmod.app, users, recorder, args)
+            else:
+                extra = await scenario(appmod.app, users, recorder, args, tokens)
+            elapsed = time.perf_counter() - started
+            count = len(recorder.latencies)
+            results[name] = {
+                'requests': count,
+                'errors': recorder.errors,
+                'seconds': elapsed,
+                'throughput': count / elapsed if elapsed else 0.0,
+                'p50_ms': percentile(recorder.latencies, 0.5) * 1000,
+                'p95_ms': percentile(recorder.latencies, 0.95) * 1000,
+                'p99_ms': percentile(recorder.latencies, 0.99) * 1000,
+                'queries_per_request': (QUERIES.value() - queries_before) / count if count else 0.0,
+                **(extra or {}),
+            }
+            print_result(name, results[name])
+    return results
+
+
+def print_result(name: str, result: dict):
+    print(f"{name:>10}: {result['requests']:>6} requests  {result['throughput']:>8.1f}/s  "
+          f"p50 {result['p50_ms']:>7.1f} ms  p95 {result['p95_ms']:>7.1f} ms  p99 {result['p99_ms']:>7.1f} ms  "
+          f"{result['queries_per_request']:>5.1f} queries/request  {result['errors']} errors")
+
+
+def compare(results: dict, path: str):
+    with open(path) as f:
+        previous = json.load(f)['results']
+    print(f'\nCompared with {path}:')
+    for name, result in results.items():
+        if name not in previous:
+            continue
+        before = previous[name]
+        changes = []
+        for key in ('throughput', 'p50_ms', 'p99_ms', 'queries_per_request'):
+            if before.get(key):
+                changes.append(f'{key} {(result[key] - before[key]) / before[key] * 100:+.0f}%')
+        print(f"{name:>10}: {', '.join(changes)}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--database', help="SQLite file to use (default: a temporary file), or ':memory:' for one in RAM")
+    parser.add_argument('--users', type=int, default=100)
+    parser.add_argument('--words', type=int, default=50, help='words per user')
+    parser.add_argument('--due-fraction', type=float, default=0.3)
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS))
+    parser.add_argument('--requests', type=int, default=500, help='requests per auth, lookup and check scenario')
+    parser.add_argument('--sessions', type=int, default=50, help='users taking part in the review and words scenarios')
+    parser.add_argument('--concurrency', type=int, default=20)
+    parser.add_argument('--dictionary-latency', type=float, default=0.05)
+    parser.add_argument('--email-latency', type=float, default=0.05)
+    parser.add_argument('--bcrypt-rounds', type=int, default=12)
+    parser.add_argument('--output', help='where to save the results (default: benchmarks/results/<timestamp>.json)')
+    parser.add_argument('--compare', help='earlier results file to compare against')
+    args = parser.parse_args()
+    args.scenarios = [name.strip() for name in args.scenarios.split(',') if name.strip()]
+    unknown = set(args.scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(sorted(unknown))}")
+
+    configure(args)
+    random.seed(0)
+    results = asyncio.run(run_scenarios(args))
+
+    output = args.output or os.path.join(RESULTS_DIR, f"{datetime.utcnow().strftime('%Y%m%dT%H%M%S')}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    settings = {key: value for key, value in vars(args).items() if key not in ('output', 'compare')}
+    with open(output, 'w') as f:
+        json.dump({'settings': settings, 'started': datetime.utcnow().isoformat(), 'results': results}, f, indent=2)
+    print(f'\nSaved results to {output}')
+
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,89 @@
+'''
+Counts how often concurrent /lookup traffic stalls the event loop, before and after moving
+dictionary lookups onto DictionaryClient.
+
+    python benchmarks/lookup_stalls.py --requests 100 --latency 0.2 --spacing 0.01
+
+Requests arrive --spacing seconds apart, like real traffic, rather than all in one loop step.
+The dictionary is replaced by a stub that sleeps for --latency seconds (like a slow scrape),
+and the cache is backed by a temporary SQLite database, so no network or Postgres is needed.
+'''
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DATABASE_URL', 'sqlite://')
+
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlmodel import SQLModel
+from definitions import DefinitionCache, DictionaryClient
+from dictionaries import RemoteDictionary
+from helpers import clean_dict
+from metrics import LoopLagMonitor
+from stubs import StubScraper
+
+
+async def make_cache():
+    # A file rather than an in-memory database, which every new connection would see empty
+    engine = create_async_engine(f'sqlite+aiosqlite:///{tempfile.mkdtemp()}/cache.db')
+    async with engine.begin() as conn:
+        await conn.run_sync(SQLModel.metadata.create_all)
+    return DefinitionCache(engine)
+
+
+async def inline_lookup(dictionary, word):
+    # What lookup_word used to do: a blocking call straight on the event loop
+    return clean_dict(dictionary.meaning('en', word))
+
+
+async def arrive(delay: float, lookup, word):
+    await asyncio.sleep(delay)
+    return await lookup(word)
+
+
+async def run(mode: str, n_requests: int, n_words: int, latency: float, spacing: float):
+    dictionary = StubScraper(latency)
+    client = DictionaryClient(RemoteDictionary(dictionary), await make_cache(), timeout=max(5, latency * 10))
+    client.start()
+    monitor = LoopLagMonitor()
+    monitor.start()
+    await asyncio.sleep(0) # let the monitor take its first reading before any request arrives
+
+    lookup = (lambda word: inline_lookup(dictionary, word)) if mode == 'inline' else client.lookup
+    words = [f'word{i % n_words}' for i in range(n_requests)]
+    started = time.perf_counter()
+    await asyncio.gather(*(arrive(i * spacing, lookup, word) for i, word in enumerate(words)))
+    elapsed = time.perf_counter() - started
+
+    # The monitor only notices a stall when it next wakes up, so give it time to wake up once more before stopping it
+    await asyncio.sleep(monitor.interval * 2)
+    await monitor.stop()
+    client.shutdown()
+    await client.cache.engine.dispose()
+    stats = monitor.stats()
+    print(f"{mode:>9}: {n_requests} lookups in {elapsed:.2f}s, upstream calls {dictionary.calls}, "
+          f"loop stalls {stats['stalls']} ({stats['total_stalled_seconds']:.2f}s in all), max lag {stats['max_lag'] * 1000:.0f}ms")
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--requests', type=int, default=100)
+    parser.add_argument('--words', type=int, default=25, help='number of distinct words, so some lookups overlap')
+    parser.add_argument('--latency', type=float, default=0.2, help='seconds each upstream lookup takes')
+    parser.add_argument('--spacing', type=float, default=0.01, help='seconds between requests arriving')
+    args = parser.parse_args()
+
+    before = asyncio.run(run('inline', args.requests, args.words, args.latency, args.spacing))
+    after = asyncio.run(run('offloaded', args.requests, args.words, args.latency, args.spacing))
+    # Lookups that block back to back merge into one long stall, so the time stalled says more than the count
+    print(f"event-loop stalls removed: {before['stalls'] - after['stalls']}, "
+          f"stalled time removed: {before['total_stalled_seconds'] - after['total_stalled_seconds']:.2f}s")
+
+
+if __name__ == '__main__':
+    main()
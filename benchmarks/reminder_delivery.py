@@ -0,0 +1,39 @@
+'''
+Measures reminder delivery throughput against the stub email transport.
+
+    python benchmarks/reminder_delivery.py --emails 5000 --latency 0.2
+
+Compares the old behaviour (one message per request, sent one at a time) with batched, concurrent delivery.
+'''
+import argparse
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from mailer import StubTransport, build_message, deliver
+
+
+def run(label, n_emails, latency, batch_size, concurrency):
+    transport = StubTransport(latency)
+    messages = (build_message(f'user{i}@example.com', 'Words to revise', 'text', '<p>html</p>') for i in range(n_emails))
+    report = deliver(messages, transport, batch_size=batch_size, concurrency=concurrency)
+    print(f'{label:>12}: {report}')
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--emails', type=int, default=2000)
+    parser.add_argument('--latency', type=float, default=0.05, help='seconds per request to the email API')
+    parser.add_argument('--batch-size', type=int, default=50)
+    parser.add_argument('--concurrency', type=int, default=4)
+    args = parser.parse_args()
+
+    before = run('one-by-one', args.emails, args.latency, batch_size=1, concurrency=1)
+    after = run('batched', args.emails, args.latency, args.batch_size, args.concurrency)
+    print(f'speed-up: {after.throughput / before.throughput:.1f}x')
+
+
+if __name__ == '__main__':
+    main()
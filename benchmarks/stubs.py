@@ -0,0 +1,19 @@
+'''
+Stand-ins for external services, shared by the benchmarks.
+'''
+import time
+
+
+class StubScraper():
+    '''
+    Stands in for MultiDictionary; blocks the calling thread for `latency` seconds like a scrape does.
+    '''
+
+    def __init__(self, latency: float):
+        self.latency = latency
+        self.calls = 0
+
+    def meaning(self, language, word):
+        self.calls += 1
+        time.sleep(self.latency)
+        return (['Noun'], f'{word} is a stub definition. {word} is another stub definition.', '')
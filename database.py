@@ -0,0 +1,90 @@
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlmodel import create_engine
+from sqlmodel.ext.asyncio.session import AsyncSession
+import threading
+import os
+
+
+DATABASE_URL = os.getenv("DATABASE_URL")
+
+POOL_SIZE = int(os.getenv('DB_POOL_SIZE', 10))
+MAX_OVERFLOW = int(os.getenv('DB_MAX_OVERFLOW', 10))
+POOL_TIMEOUT = int(os.getenv('DB_POOL_TIMEOUT_SECONDS', 10))
+# Recycle connections before Postgres or a proxy in front of it drops them for being idle
+POOL_RECYCLE = int(os.getenv('DB_POOL_RECYCLE_SECONDS', 1800))
+
+ASYNC_DRIVERS = {'postgres': 'postgresql+asyncpg', 'postgresql': 'postgresql+asyncpg', 'sqlite': 'sqlite+aiosqlite'}
+
+
+def async_url(url: str):
+    '''
+    Returns the async-driver equivalent of a database URL, e.g. postgresql://... -> postgresql+asyncpg://...
+    '''
+    scheme, rest = url.split('://', 1)
+    dialect = scheme.split('+')[0]
+    return f'{ASYNC_DRIVERS.get(dialect, scheme)}://{rest}'
+
+
+def pool_options(url: str):
+    '''
+    Returns the connection pool settings for an engine. Pre-ping discards connections that died while idle.
+    SQLite doesn't use a sized pool, so it only gets pre-ping.
+    '''
+    if url.startswith('sqlite'):
+        return {'pool_pre_ping': True}
+    return {
+        'pool_size': POOL_SIZE,
+        'max_overflow': MAX_OVERFLOW,
+        'pool_timeout': POOL_TIMEOUT,
+        'pool_recycle': POOL_RECYCLE,
+        'pool_pre_ping': True,
+    }
+
+
+# Engines are created on first use, so importing the models (or the app) needs no database driver or DATABASE_URL
+_engine = None
+_async_engine = None
+_engine_lock = threading.Lock()
+
+
+def get_engine():
+    '''
+    Returns the synchronous engine, used by background jobs, migrations and the definition cache.
+    '''
+    global _engine
+    with _engine_lock:
+        if _engine is None:
+            _engine = create_engine(DATABASE_URL, **pool_options(DATABASE_URL))
+        return _engine
+
+
+def get_async_engine():
+    '''
+    Returns the async engine that requests use.
+    '''
+    global _async_engine
+    with _engine_lock:
+        if _async_engine is None:
+            _async_engine = create_async_engine(async_url(DATABASE_URL), **pool_options(DATABASE_URL))
+        return _async_engine
+
+
+def insert_for(bind):
+    '''
+    Returns the insert() of the engine's dialect (Postgres or SQLite), which supports ON CONFLICT clauses.
+    `bind` is an engine, sync or async, e.g. session.bind.
+    '''
+    if bind.dialect.name == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+    return insert
+
+
+async def get_session():
+    '''
+    Dependency giving each request its own AsyncSession, closed (and its connection returned to the pool) afterwards.
+    Objects stay usable after commit, so endpoints can return them without another round trip.
+    '''
+    async with AsyncSession(get_async_engine(), expire_on_commit=False) as session:
+        yield session
@@ -0,0 +1,262 @@
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from sqlalchemy.exc import IntegrityError
+from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
+from models import Definition
+from database import get_async_engine
+import threading
+import asyncio
+import time
+import json
+import os
+
+
+# Returned by DefinitionCache.get() when the word has never been looked up (or its entry has expired).
+# A cached negative result ("No results found") is returned as None instead.
+MISSING = object()
+
+CACHE_SIZE = int(os.getenv('DEFINITION_CACHE_SIZE', 5000))
+CACHE_TTL = timedelta(days=int(os.getenv('DEFINITION_CACHE_TTL_DAYS', 30)))
+NEGATIVE_CACHE_TTL = timedelta(hours=int(os.getenv('DEFINITION_NEGATIVE_CACHE_TTL_HOURS', 6)))
+
+LOOKUP_WORKERS = int(os.getenv('DICTIONARY_WORKERS', 8))
+LOOKUP_TIMEOUT = float(os.getenv('DICTIONARY_TIMEOUT_SECONDS', 5))
+BREAKER_FAILURES = int(os.getenv('DICTIONARY_BREAKER_FAILURES', 5))
+BREAKER_COOLDOWN = float(os.getenv('DICTIONARY_BREAKER_COOLDOWN_SECONDS', 30))
+
+
+def normalise_word(word: str):
+    '''
+    Returns the key used to cache a word, so 'Ephemeral', 'ephemeral ' and 'EPHEMERAL' share one entry.
+    '''
+    return word.strip().lower()
+
+
+class DefinitionCache():
+    '''
+    Two-level cache of clean_dict output in front of the dictionary.
+    The first level is an in-process LRU with a maximum size, the second is the definition table,
+    which is shared by every worker and survives restarts.
+    Negative results are cached too, but expire after the shorter negative_ttl.
+    Uses the app's async engine unless given another one.
+    '''
+
+    def __init__(self, engine=None, max_size=CACHE_SIZE, ttl=CACHE_TTL, negative_ttl=NEGATIVE_CACHE_TTL):
+        self._engine = engine
+        self.max_size = max_size
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self._entries = OrderedDict() # word -> (definition, expires_at)
+        self._lock = threading.Lock()
+
+    @property
+    def engine(self):
+        return self._engine or get_async_engine()
+
+    def _expiry(self, definition, fetched_at: datetime):
+        return fetched_at + (self.ttl if definition is not None else self.negative_ttl)
+
+    def _remember(self, key, definition, expires_at: datetime):
+        with self._lock:
+            self._entries[key] = (definition, expires_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    async def get(self, word: str):
+        '''
+        Returns the cached definition of word, None if the word is cached as having no results,
+        or MISSING if it has to be fetched from the dictionary.
+        '''
+        key = normalise_word(word)
+        now = datetime.utcnow()
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry[1] > now:
+                    self._entries.move_to_end(key)
+                    return entry[0]
+                del self._entries[key]
+
+        async with AsyncSession(self.engine) as session:
+            row = (await session.exec(select(Definition).where(Definition.word == key))).first()
+        if row is None:
+            return MISSING
+
+        definition = json.loads(row.definition) if row.definition is not None else None
+        expires_at = self._expiry(definition, row.fetched_at)
+        if expires_at <= now:
+            return MISSING
+
+        self._remember(key, definition, expires_at)
+        return definition
+
+    async def put(self, word: str, definition):
+        '''
+        Stores the clean_dict output for word (or None for no results) in both levels of the cache.
+        Returns the definition now cached, which is the stored one if a re-fetch found no results.
+        '''
+        key = normalise_word(word)
+        now = datetime.utcnow()
+        encoded = json.dumps(definition) if definition is not None else None
+
+        async with AsyncSession(self.engine) as session:
+            row = (await session.exec(select(Definition).where(Definition.word == key))).first()
+            if row is None:
+                row = Definition(word=key)
+            # Words reference this row, so a failed re-fetch must not wipe out a definition they rely on
+            if encoded is not None or row.definition is None:
+                row.definition = encoded
+            else:
+                definition = json.loads(row.definition)
+            row.fetched_at = now
+            session.add(row)
+            try:
+                await session.commit()
+            except IntegrityError:
+                # Another worker cached the same word between our select and insert; theirs is just as fresh
+                await session.rollback()
+
+        self._remember(key, definition, self._expiry(definition, now))
+        return definition
+
+    def clear(self):
+        '''
+        Empties the in-process level only; the definition table is left untouched.
+        '''
+        with self._lock:
+            self._entries.clear()
+
+
+class DictionaryUnavailable(Exception):
+    '''
+    Raised when the dictionary cannot be reached, times out, or the circuit breaker is open.
+    '''
+
+
+class CircuitBreaker():
+    '''
+    Stops calling the dictionary after max_failures consecutive failures.
+    While open, calls fail immediately; after cooldown seconds a single trial call is let through,
+    and the breaker closes again if it succeeds.
+    '''
+
+    def __init__(self, max_failures=BREAKER_FAILURES, cooldown=BREAKER_COOLDOWN):
+        self.max_failures = max_failures
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at = None
+        self._trial_running = False
+
+    @property
+    def is_open(self):
+        return self.opened_at is not None
+
+    def before_call(self):
+        if self.opened_at is None:
+            return
+        if self._trial_running or time.monotonic() - self.opened_at < self.cooldown:
+            raise DictionaryUnavailable('Dictionary circuit breaker is open')
+        self._trial_running = True
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+        self._trial_running = False
+
+    def record_failure(self):
+        self.failures += 1
+        self._trial_running = False
+        if self.failures >= self.max_failures:
+            self.opened_at = time.monotonic()
+
+    def end_call(self):
+        '''
+        Called after every call, however it ended, so a trial call that was cancelled doesn't leave the breaker half-open for good.
+        '''
+        self._trial_running = False
+
+
+class DictionaryClient():
+    '''
+    Looks words up without blocking the event loop.
+    A local dictionary (see dictionaries.LocalDictionary), if given, is checked first; words it doesn't have
+    go through the cache to the remote dictionary backend.
+    The (blocking) remote dictionary is called on its own bounded thread pool, concurrent lookups
+    of the same word share one in-flight fetch, every dictionary call has a timeout, and a circuit
+    breaker fails fast while the dictionary is degraded.
+    The cache is read and written on the event loop through the async engine instead, so a hung dictionary,
+    which keeps its pool's threads busy past the timeout, never holds up lookups the cache can answer.
+    '''
+
+    def __init__(self, dictionary, cache: DefinitionCache, local=None, max_workers=LOOKUP_WORKERS, timeout=LOOKUP_TIMEOUT, breaker: CircuitBreaker = None):
+        self.dictionary = dictionary
+        self.cache = cache
+        self.local = local
+        self.timeout = timeout
+        self.breaker = breaker or CircuitBreaker()
+        self.max_workers = max_workers
+        self._executor = None # created by start()
+        self._inflight = {} # normalised word -> asyncio.Task shared by every caller looking it up
+        self.fetches = 0
+        self.coalesced = 0
+        self.local_hits = 0
+
+    async def _load(self, word: str):
+        definition = await self.cache.get(word)
+        if definition is not MISSING:
+            return definition
+
+        if self._executor is None:
+            raise RuntimeError('DictionaryClient has not been started')
+        self.breaker.before_call()
+        self.fetches += 1
+        try:
+            definition = await asyncio.wait_for(asyncio.get_running_loop().run_in_executor(self._executor, self.dictionary.define, word), self.timeout)
+        except Exception as e:
+            self.breaker.record_failure()
+            raise DictionaryUnavailable(f'Dictionary lookup failed for {word!r}') from e
+        else:
+            self.breaker.record_success()
+        finally:
+            self.breaker.end_call()
+
+        return await self.cache.put(word, definition)
+
+    async def lookup(self, word: str):
+        '''
+        Returns the clean_dict output for word, or None if the dictionary has no results.
+        Raises DictionaryUnavailable if the dictionary cannot answer in time.
+        '''
+        # A memory-mapped lookup takes microseconds, so it runs inline rather than on the thread pool
+        if self.local is not None:
+            definition = self.local.define(word)
+            if definition is not None:
+                self.local_hits += 1
+                return definition
+
+        key = normalise_word(word)
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self._load(word))
+            self._inflight[key] = task
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        else:
+            self.coalesced += 1
+
+        # shield() so that one caller giving up does not cancel the fetch for everyone else
+        try:
+            return await asyncio.wait_for(asyncio.shield(task), self.timeout * 2)
+        except asyncio.TimeoutError as e:
+            raise DictionaryUnavailable(f'Timed out looking up {word!r}') from e
+
+    def start(self):
+        self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='dictionary')
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
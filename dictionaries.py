@@ -0,0 +1,222 @@
+'''
+Dictionary backends. A backend is anything with a define(word) method returning the clean_dict output
+for the word ({'Noun Verb ': [definition, ...]}), or None if it has no entry for it.
+
+RemoteDictionary scrapes definitions through PyMultiDictionary.
+LocalDictionary reads a prebuilt dictionary file through mmap, so lookups need no network.
+Build one from the WordNet database files (and/or a tab-separated word list) with:
+
+    python dictionaries.py build dictionary.bin --wordnet /path/to/wordnet/dict --tsv extra_words.tsv
+
+then point DICTIONARY_PATH at it. Words missing from the local file are still fetched remotely.
+'''
+from metrics import timed
+import argparse
+import struct
+import mmap
+import glob
+import json
+import os
+import re
+
+
+DICTIONARY_PATH = os.getenv('DICTIONARY_PATH')
+
+# File layout: header (magic, entry count), then 2 * count + 1 offsets into the data section,
+# then the data section holding key 0, value 0, key 1, value 1, ... with the keys in sorted order.
+# Key i is data[offsets[2i]:offsets[2i+1]] and its value is data[offsets[2i+1]:offsets[2i+2]].
+MAGIC = b'VOCDICT1'
+HEADER = struct.Struct('<8sQ')
+OFFSET = struct.Struct('<Q')
+
+# clean_dict keeps at most this many definitions per word
+MAX_DEFINITIONS = 3
+
+WORDNET_CATEGORIES = {'n': 'Noun', 'v': 'Verb', 'a': 'Adjective', 's': 'Adjective', 'r': 'Adverb'}
+
+
+class RemoteDictionary():
+    '''
+    Looks words up by scraping them through PyMultiDictionary (or any object with the same meaning() method).
+    Blocks while the request is made, so call it off the event loop.
+    '''
+
+    def __init__(self, dictionary=None):
+        # Imported here so building or reading a local dictionary doesn't need the scraper or a database
+        from helpers import clean_dict
+        self._dictionary = dictionary
+        self.clean_dict = clean_dict
+
+    @property
+    def dictionary(self):
+        # The scraper is only created when the first word is looked up, so it isn't paid for at startup
+        if self._dictionary is None:
+            from PyMultiDictionary import MultiDictionary
+            self._dictionary = MultiDictionary()
+        return self._dictionary
+
+    def define(self, word: str):
+        with timed('dictionary'):
+            response = self.dictionary.meaning('en', word)
+        # Tidies the response to show only the grammatical category and definitions.
+        return self.clean_dict(response) if response[1] != '' else None
+
+    def close(self):
+        pass
+
+
+class LocalDictionary():
+    '''
+    Looks words up in a dictionary file written by build_dictionary(), with a binary search over its sorted keys.
+    The file is memory-mapped, so it is shared between workers and only the pages touched are read.
+    '''
+
+    def __init__(self, path: str):
+        self.path = path
+        self._file = open(path, 'rb')
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.count = HEADER.unpack_from(self._map, 0)
+        if magic != MAGIC:
+            self.close()
+            raise ValueError(f'{path} is not a dictionary file')
+        self._offsets = HEADER.size
+        self._data = self._offsets + OFFSET.size * (2 * self.count + 1)
+
+    def _offset(self, index: int):
+        return self._data + OFFSET.unpack_from(self._map, self._offsets + OFFSET.size * index)[0]
+
+    def _key(self, i: int):
+        return self._map[self._offset(2 * i):self._offset(2 * i + 1)]
+
+    def define(self, word: str):
+        key = word.strip().lower().encode('utf-8')
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            if self._key(middle) < key:
+                low = middle + 1
+            else:
+                high = middle
+        if low == self.count or self._key(low) != key:
+            return None
+        return json.loads(self._map[self._offset(2 * low + 1):self._offset(2 * low + 2)])
+
+    def __len__(self):
+        return self.count
+
+    def close(self):
+        self._map.close()
+        self._file.close()
+
+
+def open_local_dictionary(path: str = None):
+    '''
+    Returns a LocalDictionary for `path` or the DICTIONARY_PATH setting, or None if neither is set.
+    '''
+    path = path or DICTIONARY_PATH
+    return LocalDictionary(path) if path else None
+
+
+def build_dictionary(entries: dict, path: str):
+    '''
+    Writes {word: {category: [definitions]}} to `path` in the LocalDictionary format, keyed by lower-cased word.
+    The categories and definitions are stored in the same shape clean_dict produces.
+    Returns the number of entries written.
+    '''
+    records = []
+    for word, categories in entries.items():
+        definitions = [definition for definition_list in categories.values() for definition in definition_list][:MAX_DEFINITIONS]
+        if definitions:
+            value = {''.join(category + ' ' for category in categories): definitions}
+            records.append((word.strip().lower().encode('utf-8'), json.dumps(value).encode('utf-8')))
+    records.sort()
+
+    offsets = []
+    position = 0
+    for key, value in records:
+        offsets += [position, position + len(key)]
+        position += len(key) + len(value)
+    offsets.append(position)
+
+    # Written next to the target and renamed into place, so running workers never map a half-written file
+    temporary = f'{path}.tmp'
+    with open(temporary, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, len(records)))
+        f.write(struct.pack(f'<{len(offsets)}Q', *offsets))
+        for key, value in records:
+            f.write(key)
+            f.write(value)
+    os.replace(temporary, path)
+    return len(records)
+
+
+def add_definition(entries: dict, word: str, category: str, definition: str):
+    definition = definition.strip().rstrip('.').strip()
+    if not word or ' ' in word or not definition:
+        return
+    entries.setdefault(word.lower(), {}).setdefault(category, []).append(definition)
+
+
+def read_wordnet(directory: str, entries: dict):
+    '''
+    Adds every single-word lemma in the WordNet data.* files in `directory` to entries,
+    using the first part of each synset's gloss (before any examples) as a definition.
+    '''
+    for path in sorted(glob.glob(os.path.join(directory, 'data.*'))):
+        with open(path, encoding='utf-8', errors='replace') as f:
+            for line in f:
+                # Lines starting with spaces are the licence header
+                if line.startswith(' ') or '|' not in line:
+                    continue
+                fields, gloss = line.split('|', 1)
+                fields = fields.split()
+                category = WORDNET_CATEGORIES.get(fields[2])
+                if category is None:
+                    continue
+                definition = gloss.split(';')[0].strip().strip('"')
+                for i in range(int(fields[3], 16)):
+                    # Adjective lemmas can carry a syntactic marker, e.g. 'galore(ip)'
+                    lemma = re.sub(r'\(.*\)$', '', fields[4 + 2 * i])
+                    if '_' not in lemma:
+                        add_definition(entries, lemma, category, definition)
+
+
+def read_tsv(path: str, entries: dict):
+    '''
+    Adds the word<TAB>category<TAB>definition lines in `path` to entries.
+    '''
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            parts = line.rstrip('\n').split('\t')
+            if len(parts) == 3:
+                add_definition(entries, parts[0].strip(), parts[1].strip().title(), parts[2])
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Builds a local dictionary file for DICTIONARY_PATH.')
+    subcommands = parser.add_subparsers(dest='command', required=True)
+    build = subcommands.add_parser('build')
+    build.add_argument('output')
+    build.add_argument('--wordnet', action='append', default=[], help='directory containing the WordNet data.* files')
+    build.add_argument('--tsv', action='append', default=[], help='word<TAB>category<TAB>definition file')
+    lookup = subcommands.add_parser('lookup')
+    lookup.add_argument('path')
+    lookup.add_argument('words', nargs='+')
+    args = parser.parse_args()
+
+    if args.command == 'build':
+        entries = {}
+        for directory in args.wordnet:
+            read_wordnet(directory, entries)
+        for path in args.tsv:
+            read_tsv(path, entries)
+        count = build_dictionary(entries, args.output)
+        print(f'Wrote {count} words to {args.output} ({os.path.getsize(args.output) / 1e6:.1f} MB)')
+    else:
+        dictionary = LocalDictionary(args.path)
+        for word in args.words:
+            print(word, dictionary.define(word))
+
+
+if __name__ == '__main__':
+    main()
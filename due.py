@@ -0,0 +1,74 @@
+from datetime import datetime, timedelta
+from sqlalchemy import exists, func
+from sqlmodel import select
+from models import Word
+import threading
+import os
+
+
+# Caps how stale a cached summary can get when another worker changes the user's words
+SUMMARY_MAX_AGE = timedelta(seconds=int(os.getenv('DUE_SUMMARY_MAX_AGE_SECONDS', 60)))
+
+
+def is_due(user_id, now: datetime):
+    '''
+    SQL condition matching the user's words that are due for revision.
+    Served by the (user_id, next_review_date) index on word.
+    '''
+    return (Word.user_id == user_id) & (Word.next_review_date < now)
+
+
+async def has_due_words(session, user_id: int, now: datetime = None):
+    '''
+    Returns whether the user has any word due for revision, stopping at the first one found.
+    '''
+    now = now or datetime.utcnow()
+    return (await session.exec(select(exists().where(is_due(user_id, now))))).one()
+
+
+async def due_summary(session, user_id: int, now: datetime = None):
+    '''
+    Returns (number of words due now, when the next word that isn't due yet becomes due).
+    Both are index range scans rather than loads of every due row, and most of the time nothing is due,
+    so the count is only run once has_due_words() has found a due word.
+    '''
+    now = now or datetime.utcnow()
+    due_count = 0
+    if await has_due_words(session, user_id, now):
+        due_count = (await session.exec(select(func.count(Word.id)).where(is_due(user_id, now)))).one()
+    next_due = (await session.exec(select(func.min(Word.next_review_date)).where(Word.user_id == user_id, Word.next_review_date >= now))).one()
+    return due_count, next_due
+
+
+class DueSummaryCache():
+    '''
+    Per-user cache of due_summary().
+    An entry stays valid until its next_due time passes (when the count changes by itself),
+    until SUMMARY_MAX_AGE elapses, or until invalidate() is called after the user's words change.
+    If the caller passes the user's vocabulary version, an entry computed for an older version is also discarded,
+    which catches changes made on other workers straight away.
+    '''
+
+    def __init__(self, max_age=SUMMARY_MAX_AGE):
+        self.max_age = max_age
+        self._entries = {} # user_id -> (due_count, next_due, valid_until, version)
+        self._lock = threading.Lock()
+
+    async def get(self, session, user_id: int, version: int = None):
+        now = datetime.utcnow()
+        with self._lock:
+            entry = self._entries.get(user_id)
+        if entry is not None and now < entry[2] and (version is None or version == entry[3]):
+            return entry[0], entry[1]
+
+        due_count, next_due = await due_summary(session, user_id, now)
+        valid_until = now + self.max_age
+        if next_due is not None:
+            valid_until = min(valid_until, next_due)
+        with self._lock:
+            self._entries[user_id] = (due_count, next_due, valid_until, version)
+        return due_count, next_due
+
+    def invalidate(self, user_id: int):
+        with self._lock:
+            self._entries.pop(user_id, None)
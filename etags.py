@@ -0,0 +1,76 @@
+from collections import OrderedDict
+from fastapi import Request, Response
+from sqlalchemy import update
+from sqlmodel import select
+from models import User
+import threading
+import hashlib
+import os
+
+
+RENDERED_CACHE_SIZE = int(os.getenv('RENDERED_PAGE_CACHE_SIZE', 1000))
+
+# Browsers may keep responses but must revalidate them with If-None-Match before reusing them
+CACHE_CONTROL = 'private, no-cache'
+
+
+async def bump_version(session, user_id: int):
+    '''
+    Marks the user's vocabulary (or preferences) as changed, invalidating every ETag issued for them.
+    Runs in the caller's transaction, so the version only moves if the change is committed.
+    '''
+    await session.execute(update(User).where(User.id == user_id).values(vocab_version=User.vocab_version + 1))
+
+
+async def get_version(session, user_id: int):
+    return (await session.exec(select(User.vocab_version).where(User.id == user_id))).first() or 0
+
+
+def make_etag(*parts):
+    '''
+    Returns a weak ETag derived from everything the response depends on.
+    '''
+    digest = hashlib.sha1(':'.join(str(part) for part in parts).encode()).hexdigest()[:20]
+    return f'W/"{digest}"'
+
+
+def not_modified(request: Request, etag: str):
+    '''
+    Returns a 304 response if the client already has the representation with this ETag, otherwise None.
+    '''
+    if_none_match = request.headers.get('if-none-match', '')
+    if etag in [tag.strip() for tag in if_none_match.split(',')] or if_none_match.strip() == '*':
+        return Response(status_code=304, headers={'ETag': etag, 'Cache-Control': CACHE_CONTROL})
+    return None
+
+
+def set_etag(response: Response, etag: str):
+    response.headers['ETag'] = etag
+    response.headers['Cache-Control'] = CACHE_CONTROL
+    return response
+
+
+class RenderedPageCache():
+    '''
+    LRU of rendered pages keyed by (user id, vocabulary version), so a repeat view of an unchanged page
+    skips both its queries and its template.
+    '''
+
+    def __init__(self, max_size=RENDERED_CACHE_SIZE):
+        self.max_size = max_size
+        self._pages = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, user_id: int, version: int):
+        with self._lock:
+            page = self._pages.get((user_id, version))
+            if page is not None:
+                self._pages.move_to_end((user_id, version))
+            return page
+
+    def put(self, user_id: int, version: int, page):
+        with self._lock:
+            self._pages[(user_id, version)] = page
+            self._pages.move_to_end((user_id, version))
+            while len(self._pages) > self.max_size:
+                self._pages.popitem(last=False)
@@ -0,0 +1,89 @@
+from concurrent.futures import ThreadPoolExecutor
+from fastapi import HTTPException
+from metrics import UPSTREAM_SECONDS
+import threading
+import asyncio
+import time
+import os
+
+
+HASH_WORKERS = int(os.getenv('HASH_WORKERS', 2))
+# Hashes allowed to wait for a worker before new logins are turned away with a 503
+HASH_QUEUE_SIZE = int(os.getenv('HASH_QUEUE_SIZE', 32))
+BCRYPT_ROUNDS = int(os.getenv('BCRYPT_ROUNDS', 12))
+
+
+class PasswordHashPool():
+    '''
+    Runs bcrypt hashing and verification on its own small thread pool (bcrypt releases the GIL),
+    so a burst of logins can't use up the threadpool that serves every other request.
+    When more than queue_size hashes are waiting, further ones are refused with a 503 instead of queueing forever.
+    '''
+
+    def __init__(self, auth_handler, workers=HASH_WORKERS, queue_size=HASH_QUEUE_SIZE):
+        self.auth_handler = auth_handler
+        self.workers = workers
+        self.queue_size = queue_size
+        self._executor = None # created by start()
+        self._lock = threading.Lock()
+        self.in_flight = 0 # running plus waiting
+        self.rejected = 0
+        self.hashes = 0
+        self.hash_seconds = 0.0 # time spent hashing
+        self.wait_seconds = 0.0 # time spent waiting for a worker
+
+    @property
+    def queue_depth(self):
+        return max(self.in_flight - self.workers, 0)
+
+    def _timed(self, submitted: float, func, *args):
+        started = time.perf_counter()
+        try:
+            return func(*args)
+        finally:
+            finished = time.perf_counter()
+            UPSTREAM_SECONDS.observe(finished - started, operation='bcrypt')
+            with self._lock:
+                self.hashes += 1
+                self.hash_seconds += finished - started
+                self.wait_seconds += started - submitted
+
+    async def _run(self, func, *args):
+        if self._executor is None:
+            raise RuntimeError('PasswordHashPool has not been started')
+        with self._lock:
+            if self.in_flight >= self.workers + self.queue_size:
+                self.rejected += 1
+                raise HTTPException(status_code=503, detail='Too many logins right now, please try again shortly', headers={'Retry-After': '1'})
+            self.in_flight += 1
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._executor, self._timed, time.perf_counter(), func, *args)
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+
+    async def hash(self, password: str):
+        return await self._run(self.auth_handler.get_password_hash, password)
+
+    async def verify(self, plain_password: str, hashed_password: str):
+        return await self._run(self.auth_handler.verify_password, plain_password, hashed_password)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'in_flight': self.in_flight,
+                'queue_depth': self.queue_depth,
+                'rejected': self.rejected,
+                'hashes': self.hashes,
+                'hash_seconds': self.hash_seconds,
+                'wait_seconds': self.wait_seconds,
+            }
+
+    def start(self):
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='bcrypt')
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
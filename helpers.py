@@ -1,72 +1,124 @@
 from datetime import datetime, timedelta
-from mailjet_rest import Client
-from apscheduler.schedulers.background import BackgroundScheduler
-from models import engine, Word, User
-from sqlmodel import Session, select, distinct
+from mailer import build_message, deliver
+from models import Word, User
+from database import get_engine
+from sqlmodel import Session, select
+from sqlalchemy import exists, update
+from lease import acquire_lease, release_lease
 import os
 
 
+# NEXT_INTERVAL[current_box] -> learn words in box[1] every 1 day, in box[10] every 56 days
+NEXT_INTERVAL = [None, 1, 2, 3, 5, 8, 12, 18, 28, 42, 56] 
+
+# REDUCE_BOX[current_box] -> if word in box 3 wrong, move it back to box 2 (-1); if word in box 10 wrong, move word back to box 5 (-5)
+REDUCE_BOX = [None, 0, -1, -1, -1, -2, -2, -3, -3, -4, -5] 
+
+MAX_BOX = 10
+
+REMINDER_INTERVAL = timedelta(hours=float(os.getenv('REMINDER_INTERVAL_HOURS', 24)))
+# Longer than a reminder run can take, so the lease never expires while its holder is still sending
+REMINDER_LEASE = timedelta(minutes=int(os.getenv('REMINDER_LEASE_MINUTES', 30)))
+
+
 def start_email_scheduler():
+    '''
+    Every worker schedules the reminder job, but each run only goes ahead on the worker that wins the reminder lease.
+    The winner keeps the lease until its next run, so the other workers' ticks in between are skipped.
+    Called from the app's lifespan rather than on import.
+    '''
+    from apscheduler.schedulers.background import BackgroundScheduler
     scheduler = BackgroundScheduler()
-    scheduler.add_job(email_if_revision_due, 'interval', hours=24) 
+    scheduler.add_job(email_if_revision_due, 'interval', seconds=REMINDER_INTERVAL.total_seconds()) 
     scheduler.start()
+    return scheduler
+
+
+REMINDER_SUBJECT = 'Words to revise'
+
+REMINDER_TEXT = '''
+Hello!\n\n
+You have words to revise on Vocapp!\n\n
+Best,\n
+Vocapp
+'''
+
+REMINDER_HTML = '''
+<html>
+<body>
+    <p>Hello!</p>
+    <p>You have words to revise on <a href="https://vocapp.tomchilds.com/" target="_blank">Vocapp</a>!</p>
+    <p>Best,<br>Vocapp</p>
+</body>
+</html>
+'''
+
 
+def due_recipients(watermark: datetime, cutoff: datetime, chunk_size: int = 500):
+    '''
+    Yields the email address of every opted-in user who has a word that became due after watermark and by cutoff,
+    skipping users who still haven't revised the words their last reminder was about (they've already been told).
+    Users are only marked as reminded once their email has been sent (see mark_reminded), so failed ones are found again next run.
+    '''
+    # Only words that became due since the last run are scanned, via the index on next_review_date
+    newly_due = select(Word.user_id).where(Word.next_review_date <= cutoff)
+    if watermark is not None:
+        newly_due = newly_due.where(Word.next_review_date > watermark)
+    already_reminded = exists().where(Word.user_id == User.id, User.reminded_at.is_not(None), Word.next_review_date <= User.reminded_at)
+
+    last_id = 0
+    while True:
+        with Session(get_engine()) as session:
+            rows = session.exec(select(User.id, User.username)
+                .where(User.id > last_id, User.wants_updates, User.id.in_(newly_due), ~already_reminded)
+                .order_by(User.id)
+                .limit(chunk_size)
+                ).all()
+        if not rows:
+            return
+        for _, username in rows:
+            yield username
+        last_id = rows[-1][0]
+
+
+def mark_reminded(messages: list, cutoff: datetime):
+    '''
+    Records that the recipients of a sent batch of reminders have been told about their words due by cutoff.
+    '''
+    emails = [message['To'][0]['Email'] for message in messages]
+    with Session(get_engine()) as session:
+        session.execute(update(User).where(User.username.in_(emails)).values(reminded_at=cutoff))
+        session.commit()
+
+
+def email_if_revision_due(transport=None):
+    '''
+    Emails opted-in users whose words have become due since the last run, in concurrent Mailjet batches.
+    Only the worker holding the reminder lease runs; the others return None straight away.
+    After a run the lease is held for another REMINDER_INTERVAL, so there is one run per interval however many workers there are;
+    if its holder goes away, another worker takes over at its first tick after that.
+    Returns the DeliveryReport for the run.
+    '''
+    lease = acquire_lease(get_engine(), 'reminders', REMINDER_LEASE)
+    if lease is None:
+        return None
 
-def email_if_revision_due():
     print('checking if emails due')
-    with Session(engine) as session:
-        user_ids = session.exec(select(distinct(Word.user_id)).where(Word.next_review_date < datetime.utcnow())).all()
-        if user_ids:
-            for user_id in user_ids:
-                user = session.exec(select(User).where(User.id == user_id)).first()
-                if user.wants_updates:
-                    email = user.username
-
-                    text_content = '''
-                    Hello!\n\n
-                    You have words to revise on Vocapp!\n\n
-                    Best,\n
-                    Vocapp
-                    '''
-
-                    html_content = '''
-                    <html>
-                    <body>
-                        <p>Hello!</p>
-                        <p>You have words to revise on <a href="https://vocapp.tomchilds.com/" target="_blank">Vocapp</a>!</p>
-                        <p>Best,<br>Vocapp</p>
-                    </body>
-                    </html>
-                    '''
-
-                    send_email(email, subject='Words to revise', text_content=text_content, html_content=html_content)
-
-
-def send_email(recipient_email, subject, text_content, html_content):
-    print('sending email to', recipient_email)
-    api_key = os.getenv('API_KEY')
-    api_secret = os.getenv('API_SECRET')  
-    mailjet = Client(auth=(api_key, api_secret), version='v3.1')
-
-    data = {
-        'Messages': [
-            {
-                "From": {
-                    "Email": "vocapp.reminder@gmail.com", 
-                    "Name": "Vocapp"  
-                },
-                "To": [
-                    {
-                        "Email": recipient_email
-                    }
-                ],
-                "Subject": subject,
-                "TextPart": text_content,
-                "HTMLPart": html_content
-            }
-        ]
-    }
-    return mailjet.send.create(data=data)
+    cutoff = datetime.utcnow()
+    try:
+        messages = (build_message(email, REMINDER_SUBJECT, REMINDER_TEXT, REMINDER_HTML) for email in due_recipients(lease.watermark, cutoff))
+        report = deliver(messages, transport, on_sent=lambda sent: mark_reminded(sent, cutoff))
+    except Exception:
+        # Users emailed so far are already marked as reminded; leave the watermark where it was so the next run covers the rest of this window again
+        release_lease(get_engine(), 'reminders')
+        raise
+    if report.failed:
+        # The users whose emails failed weren't marked as reminded; keeping the old watermark makes the next run look for them again
+        release_lease(get_engine(), 'reminders', hold_until=cutoff + REMINDER_INTERVAL)
+    else:
+        release_lease(get_engine(), 'reminders', watermark=cutoff, hold_until=cutoff + REMINDER_INTERVAL)
+    print(report)
+    return report
 
 
 def clean_dict(response: tuple):
@@ -91,7 +143,7 @@ def clean_dict(response: tuple):
     return {categories: definitions_list}
 
 
-def update_box(current_box: int, is_correct: bool):
+def update_box(current_box: int, is_correct: bool, now: datetime = None):
     '''
     Implements spaced-repetition algo.
     When words are correctly recalled from their definition, they are moved to the next box.
@@ -99,15 +151,9 @@ def update_box(current_box: int, is_correct: bool):
     The box they are in depends when they will next be reviewed.
     Words in higher boxes are demoted most, up to -5 boxes lower.
     Words in higher boxes have a greater interval until their next revision date, up to 56 days.
+    See scheduling.update_boxes for the same algorithm applied to many words at once.
     '''
-
-    # NEXT_INTERVAL[current_box] -> learn words in box[1] every 1 day, in box[10] every 56 days
-    NEXT_INTERVAL = [None, 1, 2, 3, 5, 8, 12, 18, 28, 42, 56] 
-
-    # REDUCE_BOX[current_box] -> if word in box 3 wrong, move it back to box 2 (-1); if word in box 10 wrong, move word back to box 5 (-5)
-    REDUCE_BOX = [None, 0, -1, -1, -1, -2, -2, -3, -3, -4, -5] 
-
-    if is_correct and current_box < 10:
+    if is_correct and current_box < MAX_BOX:
         new_box = current_box + 1
     elif not is_correct: 
         new_box = current_box + REDUCE_BOX[current_box]
@@ -115,8 +161,8 @@ def update_box(current_box: int, is_correct: bool):
         # Current box does not change as it either cannot go any lower or higher
         new_box = current_box
 
-    last_reviewed_date = datetime.utcnow()
-    next_review_date = datetime.utcnow() + timedelta(days=NEXT_INTERVAL[new_box])
+    last_reviewed_date = now or datetime.utcnow()
+    next_review_date = last_reviewed_date + timedelta(days=NEXT_INTERVAL[new_box])
 
     return new_box, last_reviewed_date, next_review_date
 
@@ -0,0 +1,189 @@
+'''
+Bulk import of word lists (plain text, one word per line, or CSV with the word in the first column).
+
+    DATABASE_URL=... python importer.py --username teacher@example.com words.csv
+
+The same import runs behind POST /import, which streams its progress as NDJSON.
+'''
+from datetime import datetime, timedelta
+from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
+from models import Word, Definition
+from definitions import DictionaryUnavailable, normalise_word
+from etags import bump_version
+from database import insert_for
+from stats import ReviewLog, apply_events, review_event
+import argparse
+import asyncio
+import csv
+import io
+import json
+import os
+
+
+IMPORT_CONCURRENCY = int(os.getenv('IMPORT_CONCURRENCY', 8))
+INSERT_CHUNK_SIZE = int(os.getenv('IMPORT_CHUNK_SIZE', 500))
+# Longest word list POST /import accepts; the CLI has no limit
+MAX_IMPORT_WORDS = int(os.getenv('MAX_IMPORT_WORDS', 5000))
+
+
+def parse_word_list(text: str):
+    '''
+    Returns the distinct words in a plain-text or CSV word list, title-cased like /lookup stores them,
+    in the order they first appear. Blank cells, multi-word entries and a 'word' header are skipped.
+    '''
+    words = {}
+    for row in csv.reader(io.StringIO(text)):
+        if not row:
+            continue
+        word = row[0].strip()
+        if not word or len(word.split()) > 1 or word.lower() == 'word':
+            continue
+        words.setdefault(normalise_word(word), word.title())
+    return list(words.values())
+
+
+async def insert_words(engine, user_id: int, found: list, review_log: ReviewLog):
+    '''
+    Inserts (word, definition) pairs for the user with one multi-row INSERT, pointing each at its shared definition,
+    and returns the words that were added; any the user added meanwhile (e.g. with /lookup) are skipped.
+    Their 'added' events go into the user's stats in the same transaction and then to review_log.
+    '''
+    now = datetime.utcnow()
+    async with AsyncSession(engine) as session:
+        # The dictionary client stores what it fetches, but words answered by the local dictionary may have no row yet,
+        # or only a cached "no results" one. The upsert fills in any missing definition and leaves stored ones alone,
+        # so another request inserting the same words meanwhile does no harm; the ids are read afterwards.
+        insert = insert_for(session.bind)
+        definitions = {normalise_word(word): json.dumps(definition) for word, definition in found}
+        upsert = insert(Definition)
+        upsert = upsert.on_conflict_do_update(
+            index_elements=['word'],
+            set_={'definition': upsert.excluded.definition, 'fetched_at': upsert.excluded.fetched_at},
+            where=Definition.definition.is_(None))
+        await session.execute(upsert, [{'word': key, 'definition': definition, 'fetched_at': now} for key, definition in definitions.items()])
+        definition_ids = dict((await session.exec(select(Definition.word, Definition.id).where(Definition.word.in_(definitions)))).all())
+
+        rows = [{
+            'word': word,
+            'definition_id': definition_ids.get(normalise_word(word)),
+            'box_number': 1,
+            'last_reviewed_date': now,
+            'next_review_date': now + timedelta(days=1),
+            'user_id': user_id,
+        } for word, _ in found]
+        added = (await session.execute(insert(Word).on_conflict_do_nothing(index_elements=['user_id', 'word']).returning(Word.word), rows)).scalars().all()
+        events = [review_event(user_id, word, 'added', box_after=1, now=now) for word in added]
+        await apply_events(session, user_id, events)
+        await bump_version(session, user_id)
+        await session.commit()
+    review_log.record(events)
+    return added
+
+
+async def import_words(engine, dictionary_client, user_id: int, words: list, review_log: ReviewLog, concurrency=IMPORT_CONCURRENCY, chunk_size=INSERT_CHUNK_SIZE, on_insert=None):
+    '''
+    Adds a list of words to the user's word list, yielding a progress event for every word as it's processed:
+    {'word', 'status'} where status is 'added', 'exists', 'not_found' or 'failed', plus a final {'summary'} event.
+    Words already in the list are filtered out with one query, the rest are looked up concurrently
+    (at most `concurrency` at a time) and inserted in chunks of chunk_size.
+    on_insert(user_id) is called after each chunk is committed.
+    '''
+    counts = {'added': 0, 'exists': 0, 'not_found': 0, 'failed': 0}
+
+    async with AsyncSession(engine) as session:
+        existing = set((await session.exec(select(Word.word).where(Word.user_id == user_id, Word.word.in_(words)))).all())
+    for word in words:
+        if word in existing:
+            counts['exists'] += 1
+            yield {'word': word, 'status': 'exists'}
+
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def lookup(word):
+        async with semaphore:
+            try:
+                return word, await dictionary_client.lookup(word), None
+            except DictionaryUnavailable as e:
+                return word, None, str(e)
+
+    async def insert_chunk(chunk):
+        added = set(await insert_words(engine, user_id, chunk, review_log))
+        for word, _ in chunk:
+            status = 'added' if word in added else 'exists'
+            counts[status] += 1
+            yield {'word': word, 'status': status}
+        if on_insert and added:
+            on_insert(user_id)
+
+    pending = [asyncio.ensure_future(lookup(word)) for word in words if word not in existing]
+    found = []
+    try:
+        for next_done in asyncio.as_completed(pending):
+            word, definition, error = await next_done
+            if error:
+                counts['failed'] += 1
+                yield {'word': word, 'status': 'failed', 'error': error}
+                continue
+            if definition is None:
+                counts['not_found'] += 1
+                yield {'word': word, 'status': 'not_found'}
+                continue
+
+            found.append((word, definition))
+            if len(found) >= chunk_size:
+                async for event in insert_chunk(found):
+                    yield event
+                found = []
+
+        if found:
+            async for event in insert_chunk(found):
+                yield event
+    finally:
+        # If the client goes away mid-import, don't leave lookups running for nobody
+        for task in pending:
+            task.cancel()
+
+    yield {'summary': counts, 'total': len(words)}
+
+
+async def main(args):
+    from dictionaries import RemoteDictionary, open_local_dictionary
+    from sqlmodel import Session
+    from models import User
+    from database import get_engine, get_async_engine
+    from definitions import DefinitionCache, DictionaryClient
+
+    with Session(get_engine()) as session:
+        user = session.exec(select(User).where(User.username == args.username)).first()
+    if user is None:
+        raise SystemExit(f'No user called {args.username}')
+
+    with open(args.file, encoding='utf-8') as f:
+        words = parse_word_list(f.read())
+
+    client = DictionaryClient(RemoteDictionary(), DefinitionCache(), local=open_local_dictionary())
+    client.start()
+    review_log = ReviewLog()
+    review_log.start()
+    processed = 0
+    async for event in import_words(get_async_engine(), client, user.id, words, review_log, concurrency=args.concurrency):
+        if 'summary' in event:
+            print(f"done: {event['summary']}")
+            continue
+        processed += 1
+        if event['status'] in ('failed', 'not_found'):
+            print(f"{event['word']}: {event['status']} {event.get('error', '')}".rstrip())
+        if processed % 100 == 0:
+            print(f'{processed}/{len(words)} processed')
+    client.shutdown()
+    await review_log.stop()
+    await get_async_engine().dispose()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Imports a word list into a user\'s vocabulary.')
+    parser.add_argument('file', help='plain-text (one word per line) or CSV (word in the first column) file')
+    parser.add_argument('--username', required=True)
+    parser.add_argument('--concurrency', type=int, default=IMPORT_CONCURRENCY)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,58 @@
+from datetime import datetime, timedelta
+from sqlalchemy import update, or_
+from sqlalchemy.exc import IntegrityError
+from sqlmodel import Session
+from models import SchedulerLease
+import socket
+import uuid
+import os
+
+
+# Identifies this process; every worker and dyno gets a different one
+HOLDER = f'{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:8]}'
+
+
+def acquire_lease(engine, name: str, duration: timedelta, holder: str = HOLDER):
+    '''
+    Tries to take the named lease for `duration`. Only one holder can have an unexpired lease at a time.
+    Returns the SchedulerLease if it was acquired, or None if someone else holds it.
+    '''
+    now = datetime.utcnow()
+    with Session(engine) as session:
+        # A single conditional UPDATE, so two workers racing for the lease can't both win
+        result = session.execute(update(SchedulerLease)
+            .where(SchedulerLease.name == name, or_(SchedulerLease.expires_at < now, SchedulerLease.holder == holder))
+            .values(holder=holder, expires_at=now + duration))
+        session.commit()
+        if result.rowcount:
+            return session.get(SchedulerLease, name)
+
+        if session.get(SchedulerLease, name) is not None:
+            return None
+        lease = SchedulerLease(name=name, holder=holder, expires_at=now + duration)
+        session.add(lease)
+        try:
+            session.commit()
+        except IntegrityError:
+            # Another worker created the lease first
+            return None
+        session.refresh(lease)
+        return lease
+
+
+def release_lease(engine, name: str, watermark: datetime = None, holder: str = HOLDER, hold_until: datetime = None):
+    '''
+    Gives up the lease, recording the new watermark if one is given.
+    With hold_until, the holder keeps the lease until then instead, so other workers can't take it in the meantime
+    (the holder itself can always take it again).
+    Returns False if the lease had already expired and been taken by someone else.
+    '''
+    values = {'expires_at': hold_until or datetime.utcnow()}
+    if watermark is not None:
+        values['watermark'] = watermark
+    with Session(engine) as session:
+        result = session.execute(update(SchedulerLease)
+            .where(SchedulerLease.name == name, SchedulerLease.holder == holder)
+            .values(**values))
+        session.commit()
+    return bool(result.rowcount)
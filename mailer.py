@@ -0,0 +1,178 @@
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from metrics import timed
+import threading
+import time
+import os
+
+
+# Mailjet's Send API v3.1 accepts up to 50 messages per request
+BATCH_SIZE = int(os.getenv('EMAIL_BATCH_SIZE', 50))
+CONCURRENCY = int(os.getenv('EMAIL_CONCURRENCY', 4))
+RETRIES = int(os.getenv('EMAIL_RETRIES', 3))
+RETRY_BACKOFF = float(os.getenv('EMAIL_RETRY_BACKOFF_SECONDS', 1))
+
+SENDER = {"Email": "vocapp.reminder@gmail.com", "Name": "Vocapp"}
+
+
+class TransientSendError(Exception):
+    '''
+    Raised by a transport when a batch failed in a way worth retrying (rate limiting, server errors, timeouts).
+    '''
+
+
+class PermanentSendError(Exception):
+    '''
+    Raised by a transport when a batch was rejected and retrying would not help.
+    '''
+
+
+def build_message(recipient_email, subject, text_content, html_content):
+    '''
+    Returns one message in the Mailjet v3.1 format.
+    '''
+    return {
+        "From": SENDER,
+        "To": [
+            {
+                "Email": recipient_email
+            }
+        ],
+        "Subject": subject,
+        "TextPart": text_content,
+        "HTMLPart": html_content
+    }
+
+
+class MailjetTransport():
+    '''
+    Sends batches of messages through Mailjet, reusing one client (and its HTTP connections) for every batch.
+    '''
+
+    def __init__(self, api_key=None, api_secret=None):
+        # Imported here so only processes that actually send email pay for loading the Mailjet client
+        from mailjet_rest import Client
+        self.client = Client(auth=(api_key or os.getenv('API_KEY'), api_secret or os.getenv('API_SECRET')), version='v3.1')
+
+    def send(self, messages: list):
+        try:
+            response = self.client.send.create(data={'Messages': messages})
+        except Exception as e:
+            raise TransientSendError(str(e)) from e
+        if response.status_code == 429 or response.status_code >= 500:
+            raise TransientSendError(f'Mailjet returned {response.status_code}')
+        if response.status_code >= 400:
+            raise PermanentSendError(f'Mailjet returned {response.status_code}: {response.text}')
+        return response
+
+
+class StubTransport():
+    '''
+    Pretends to send messages, taking `latency` seconds per batch. Used for local runs and benchmarks.
+    '''
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.batches = 0
+        self.messages = 0
+        self._lock = threading.Lock()
+
+    def send(self, messages: list):
+        time.sleep(self.latency)
+        with self._lock:
+            self.batches += 1
+            self.messages += len(messages)
+
+
+TRANSPORTS = {'mailjet': MailjetTransport, 'stub': StubTransport}
+
+
+def get_transport(name: str = None):
+    '''
+    Returns the transport named by `name` or the EMAIL_BACKEND setting ('mailjet' by default, or 'stub').
+    '''
+    return TRANSPORTS[name or os.getenv('EMAIL_BACKEND', 'mailjet')]()
+
+
+class DeliveryReport():
+    '''
+    Counts what happened during one delivery run.
+    '''
+
+    def __init__(self):
+        self.sent = 0
+        self.failed = 0
+        self.batches = 0
+        self.retries = 0
+        self.started = time.perf_counter()
+        self.elapsed = 0.0
+
+    @property
+    def throughput(self):
+        return self.sent / self.elapsed if self.elapsed else 0.0
+
+    def __str__(self):
+        return (f'sent {self.sent} emails in {self.batches} batches ({self.failed} failed, {self.retries} retries) '
+                f'in {self.elapsed:.2f}s, {self.throughput:.1f} emails/s')
+
+
+def send_batch(transport, messages: list, report: DeliveryReport, lock: threading.Lock, retries=RETRIES, backoff=RETRY_BACKOFF, on_sent=None):
+    '''
+    Sends one batch, retrying transient failures with exponential backoff.
+    on_sent(messages) is called once the batch has been sent.
+    '''
+    for attempt in range(retries + 1):
+        try:
+            with timed('email'):
+                transport.send(messages)
+            with lock:
+                report.sent += len(messages)
+                report.batches += 1
+            if on_sent is not None:
+                try:
+                    on_sent(messages)
+                except Exception as e:
+                    print('could not record sent batch:', e)
+            return
+        except TransientSendError as e:
+            if attempt == retries:
+                print('giving up on batch:', e)
+                break
+            with lock:
+                report.retries += 1
+            time.sleep(backoff * 2 ** attempt)
+        except PermanentSendError as e:
+            print('batch rejected:', e)
+            break
+    with lock:
+        report.failed += len(messages)
+
+
+def deliver(messages, transport=None, batch_size=BATCH_SIZE, concurrency=CONCURRENCY, retries=RETRIES, backoff=RETRY_BACKOFF, on_sent=None):
+    '''
+    Sends an iterable of messages in batches of batch_size, with at most `concurrency` batches in flight.
+    The iterable is consumed lazily, so recipients can be streamed from the database.
+    on_sent(messages) is called (on a sender thread) for every batch that was sent; batches that failed are only counted.
+    Returns a DeliveryReport.
+    '''
+    transport = transport or get_transport()
+    report = DeliveryReport()
+    lock = threading.Lock()
+
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='mailer') as executor:
+        pending = set()
+        batch = []
+        for message in messages:
+            batch.append(message)
+            if len(batch) < batch_size:
+                continue
+            # Don't read further ahead than the senders can keep up with
+            if len(pending) >= concurrency:
+                _, pending = wait(pending, return_when=FIRST_COMPLETED)
+            pending.add(executor.submit(send_batch, transport, batch, report, lock, retries, backoff, on_sent))
+            batch = []
+        if batch:
+            pending.add(executor.submit(send_batch, transport, batch, report, lock, retries, backoff, on_sent))
+        wait(pending)
+
+    report.elapsed = time.perf_counter() - report.started
+    return report
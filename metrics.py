@@ -0,0 +1,259 @@
+from contextlib import contextmanager
+from sqlalchemy import event
+import contextvars
+import weakref
+import threading
+import asyncio
+import time
+import os
+
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100, 250)
+# Requests slower than this are printed along with their query count; 0 turns the log off
+SLOW_REQUEST_SECONDS = float(os.getenv('SLOW_REQUEST_SECONDS', 0))
+
+
+class LoopLagMonitor():
+    '''
+    Measures how responsive the event loop is.
+    Every interval seconds it checks how late it woke up; a wake-up later than threshold seconds
+    counts as a stall, i.e. something blocked the loop and every other request on the worker had to wait.
+    '''
+
+    def __init__(self, interval: float = 0.05, threshold: float = 0.1):
+        self.interval = interval
+        self.threshold = threshold
+        self.stalls = 0
+        self.max_lag = 0.0
+        self.total_lag = 0.0
+        self._task = None
+
+    async def _run(self):
+        while True:
+            started = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            lag = time.perf_counter() - started - self.interval
+            if lag > self.threshold:
+                self.stalls += 1
+                self.total_lag += lag
+            self.max_lag = max(self.max_lag, lag)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def stats(self):
+        return {'stalls': self.stalls, 'max_lag': self.max_lag, 'total_stalled_seconds': self.total_lag}
+
+
+def format_labels(labels: dict):
+    if not labels:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for value in labels.values())
+    return '{' + ','.join(f'{name}="{value}"' for name, value in zip(labels, escaped)) + '}'
+
+
+class Counter():
+    def __init__(self, name: str, help: str):
+        self.name = name
+        self.help = help
+        self._values = {} # sorted label items -> value
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        with self._lock:
+            return self._values.get(tuple(sorted(labels.items())), 0)
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} counter']
+        with self._lock:
+            for key, value in self._values.items():
+                lines.append(f'{self.name}{format_labels(dict(key))} {value}')
+        return lines
+
+
+class Histogram():
+    def __init__(self, name: str, help: str, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.buckets = tuple(buckets)
+        self._values = {} # sorted label items -> [count per bucket..., count, sum]
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            values = self._values.get(key)
+            if values is None:
+                values = self._values[key] = [0] * (len(self.buckets) + 2)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    values[i] += 1
+            values[-2] += 1
+            values[-1] += value
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            for key, values in self._values.items():
+                labels = dict(key)
+                for bound, count in zip(self.buckets, values):
+                    lines.append(f'{self.name}_bucket{format_labels({**labels, "le": bound})} {count}')
+                lines.append(f'{self.name}_bucket{format_labels({**labels, "le": "+Inf"})} {values[-2]}')
+                lines.append(f'{self.name}_count{format_labels(labels)} {values[-2]}')
+                lines.append(f'{self.name}_sum{format_labels(labels)} {values[-1]}')
+        return lines
+
+
+class MetricsRegistry():
+    '''
+    Holds the app's metrics and renders them in the Prometheus text format.
+    Collectors are functions returning {name: value}, read at scrape time and exposed as gauges,
+    for stats that other components already keep (loop lag, the bcrypt pool, the dictionary client).
+    '''
+
+    def __init__(self):
+        self.metrics = []
+        self.collectors = []
+
+    def counter(self, name: str, help: str):
+        self.metrics.append(Counter(name, help))
+        return self.metrics[-1]
+
+    def histogram(self, name: str, help: str, buckets=LATENCY_BUCKETS):
+        self.metrics.append(Histogram(name, help, buckets))
+        return self.metrics[-1]
+
+    def add_collector(self, collector):
+        self.collectors.append(collector)
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines += metric.render()
+        for collector in self.collectors:
+            for name, value in collector().items():
+                lines += [f'# TYPE {name} gauge', f'{name} {float(value)}']
+        return '\n'.join(lines) + '\n'
+
+
+registry = MetricsRegistry()
+REQUESTS = registry.counter('http_requests_total', 'Requests handled, by route and status code.')
+REQUEST_SECONDS = registry.histogram('http_request_duration_seconds', 'Time to handle a request, including streaming its body.')
+REQUEST_QUERIES = registry.histogram('http_request_db_queries', 'Database queries made while handling a request.', QUERY_COUNT_BUCKETS)
+REQUEST_DB_SECONDS = registry.histogram('http_request_db_seconds', 'Time spent in database queries while handling a request.')
+QUERIES = registry.counter('db_queries_total', 'Database queries executed, in or out of a request.')
+QUERY_SECONDS = registry.histogram('db_query_duration_seconds', 'Time to execute one database query.')
+UPSTREAM_SECONDS = registry.histogram('upstream_duration_seconds', 'Time spent in slow external work: dictionary scrapes, bcrypt and email sends.')
+
+
+class RequestStats():
+    def __init__(self):
+        self.queries = 0
+        self.db_seconds = 0.0
+
+
+# Set by MetricsMiddleware for the duration of each request, so the engine hooks can attribute queries to it
+current_request = contextvars.ContextVar('current_request', default=None)
+
+_instrumented = weakref.WeakSet()
+
+
+def instrument_engine(engine):
+    '''
+    Times every query run on the engine (sync or async), adding it to the current request's stats if there is one.
+    Queries run on other threads, like the definition cache's, are only counted in the totals.
+    Safe to call again for an engine that is already instrumented.
+    '''
+    engine = getattr(engine, 'sync_engine', engine)
+    if engine in _instrumented:
+        return
+    _instrumented.add(engine)
+
+    @event.listens_for(engine, 'before_cursor_execute')
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('query_started', []).append(time.perf_counter())
+
+    @event.listens_for(engine, 'after_cursor_execute')
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info['query_started'].pop()
+        QUERIES.inc()
+        QUERY_SECONDS.observe(elapsed)
+        stats = current_request.get()
+        if stats is not None:
+            stats.queries += 1
+            stats.db_seconds += elapsed
+
+    @event.listens_for(engine, 'handle_error')
+    def handle_error(context):
+        if context.connection is not None and context.connection.info.get('query_started'):
+            context.connection.info['query_started'].pop()
+
+
+@contextmanager
+def timed(operation: str):
+    '''
+    Records how long the block takes in upstream_duration_seconds under `operation`.
+    '''
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        UPSTREAM_SECONDS.observe(time.perf_counter() - started, operation=operation)
+
+
+class MetricsMiddleware():
+    '''
+    ASGI middleware recording each request's latency, status code and database usage, labelled by route template
+    (e.g. /words/page rather than the raw URL, so the number of series stays bounded).
+    Requests slower than slow_request_seconds are printed along with how many queries they made.
+    '''
+
+    def __init__(self, app, slow_request_seconds: float = SLOW_REQUEST_SECONDS):
+        self.app = app
+        self.slow_request_seconds = slow_request_seconds
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            return await self.app(scope, receive, send)
+
+        stats = RequestStats()
+        token = current_request.set(stats)
+        status = 500
+        started = time.perf_counter()
+
+        async def send_with_status(message):
+            nonlocal status
+            if message['type'] == 'http.response.start':
+                status = message['status']
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            elapsed = time.perf_counter() - started
+            current_request.reset(token)
+            # The router stores the matched route in the scope
+            route = getattr(scope.get('route'), 'path', 'unmatched')
+            method = scope['method']
+            REQUESTS.inc(method=method, route=route, status=status)
+            REQUEST_SECONDS.observe(elapsed, method=method, route=route)
+            REQUEST_QUERIES.observe(stats.queries, route=route)
+            REQUEST_DB_SECONDS.observe(stats.db_seconds, route=route)
+            if self.slow_request_seconds and elapsed > self.slow_request_seconds:
+                print(f'slow request: {method} {scope["path"]} {status} took {elapsed:.3f}s, {stats.queries} queries, {stats.db_seconds:.3f}s in the database')
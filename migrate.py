@@ -0,0 +1,159 @@
+'''
+One-off schema migrations for existing databases.
+create_all() only creates missing tables, so changes to existing tables are applied here.
+
+    DATABASE_URL=... python migrate.py
+'''
+from datetime import datetime
+from sqlalchemy import inspect, text
+from sqlmodel import SQLModel
+from database import get_engine
+from definitions import normalise_word
+from stats import BOXES
+
+
+def migrate_word_definitions(engine, batch_size=1000):
+    '''
+    Moves the per-user JSON copies in word.definition into the shared definition table.
+    Adds word.definition_id, creates one definition row per normalised word, points every word at it,
+    and finally drops word.definition. Safe to re-run: each step is skipped once it has been applied.
+    '''
+    SQLModel.metadata.create_all(engine)
+
+    columns = {column['name'] for column in inspect(engine).get_columns('word')}
+    if 'definition_id' not in columns:
+        with engine.begin() as conn:
+            conn.execute(text('ALTER TABLE word ADD COLUMN definition_id INTEGER REFERENCES definition (id)'))
+            conn.execute(text('CREATE INDEX ix_word_definition_id ON word (definition_id)'))
+
+    if 'definition' not in columns:
+        print('word.definition already migrated')
+        return
+
+    with engine.begin() as conn:
+        stored = dict(conn.execute(text('SELECT word, definition FROM definition')).all())
+
+        # Stream the old copies so that large word tables are never held in memory at once
+        new_rows, filled_rows = {}, {}
+        result = conn.execution_options(stream_results=True).execute(text('SELECT word, definition FROM word WHERE definition_id IS NULL'))
+        for word, definition in result:
+            key = normalise_word(word)
+            if key not in stored:
+                new_rows.setdefault(key, definition)
+            elif stored[key] is None:
+                # Only a cached "no results" exists, but this user's copy has a real definition
+                filled_rows.setdefault(key, definition)
+
+        now = datetime.utcnow()
+        rows = [{'word': key, 'definition': definition, 'fetched_at': now} for key, definition in new_rows.items()]
+        for start in range(0, len(rows), batch_size):
+            conn.execute(text('INSERT INTO definition (word, definition, fetched_at) VALUES (:word, :definition, :fetched_at)'), rows[start:start + batch_size])
+        if filled_rows:
+            conn.execute(text('UPDATE definition SET definition = :definition, fetched_at = :fetched_at WHERE word = :word'),
+                         [{'word': key, 'definition': definition, 'fetched_at': now} for key, definition in filled_rows.items()])
+
+        conn.execute(text('''
+            UPDATE word SET definition_id = (SELECT definition.id FROM definition WHERE definition.word = lower(word.word))
+            WHERE definition_id IS NULL
+        '''))
+        conn.execute(text('ALTER TABLE word DROP COLUMN definition'))
+
+    print(f'created {len(new_rows)} shared definitions, filled {len(filled_rows)}, dropped word.definition')
+
+
+def migrate_due_index(engine):
+    '''
+    Adds the (user_id, next_review_date) index on word, which create_all() won't add to an existing table.
+    '''
+    with engine.begin() as conn:
+        conn.execute(text('CREATE INDEX IF NOT EXISTS ix_word_user_id_next_review_date ON word (user_id, next_review_date)'))
+
+
+def migrate_token_version(engine):
+    '''
+    Adds user.token_version, which revokes tokens issued before it was bumped.
+    '''
+    columns = {column['name'] for column in inspect(engine).get_columns('user')}
+    if 'token_version' not in columns:
+        with engine.begin() as conn:
+            conn.execute(text('ALTER TABLE "user" ADD COLUMN token_version INTEGER NOT NULL DEFAULT 0'))
+
+
+def migrate_reminder_state(engine):
+    '''
+    Adds user.reminded_at and the word.next_review_date index used by the incremental reminder job.
+    The schedulerlease table itself is created by create_all().
+    '''
+    SQLModel.metadata.create_all(engine)
+    columns = {column['name'] for column in inspect(engine).get_columns('user')}
+    with engine.begin() as conn:
+        if 'reminded_at' not in columns:
+            conn.execute(text('ALTER TABLE "user" ADD COLUMN reminded_at TIMESTAMP'))
+        conn.execute(text('CREATE INDEX IF NOT EXISTS ix_word_next_review_date ON word (next_review_date)'))
+
+
+def migrate_vocab_version(engine):
+    '''
+    Adds user.vocab_version, which the ETags on /getwords, /words, /check and /emailpreference are derived from.
+    '''
+    columns = {column['name'] for column in inspect(engine).get_columns('user')}
+    if 'vocab_version' not in columns:
+        with engine.begin() as conn:
+            conn.execute(text('ALTER TABLE "user" ADD COLUMN vocab_version INTEGER NOT NULL DEFAULT 0'))
+
+
+def migrate_review_stats(engine):
+    '''
+    Creates the reviewevent, userstats and dailyreviews tables and seeds them for existing users:
+    every word a user already has is logged as 'added' into its current box, and their box counts are
+    filled in to match. Review history from before the log existed can't be recovered, so reviews start at 0.
+    Users who already have a userstats row are skipped, so it is safe to re-run.
+    '''
+    SQLModel.metadata.create_all(engine)
+    box_counts = ', '.join(f'SUM(CASE WHEN box_number = {box} THEN 1 ELSE 0 END)' for box in BOXES)
+    box_columns = ', '.join(f'box_{box}' for box in BOXES)
+    with engine.begin() as conn:
+        logged = conn.execute(text('''
+            INSERT INTO reviewevent (user_id, word, kind, box_after, created_at)
+            SELECT user_id, word, 'added', box_number, last_reviewed_date FROM word
+            WHERE NOT EXISTS (SELECT 1 FROM userstats WHERE userstats.user_id = word.user_id)
+            ORDER BY id
+        ''')).rowcount
+        seeded = conn.execute(text(f'''
+            INSERT INTO userstats (user_id, words, reviews, correct, {box_columns}, current_streak, longest_streak)
+            SELECT user_id, COUNT(*), 0, 0, {box_counts}, 0, 0 FROM word
+            WHERE NOT EXISTS (SELECT 1 FROM userstats WHERE userstats.user_id = word.user_id)
+            GROUP BY user_id
+        ''')).rowcount
+    print(f'seeded stats for {seeded} users from {logged} existing words')
+
+
+def migrate_unique_words(engine):
+    '''
+    Adds the unique (user_id, word) index that adding a word relies on to reject duplicates.
+    Duplicates left by the old select-then-insert are removed first, keeping each user's oldest copy;
+    for users whose stats are already kept, the removals are logged as 'deleted' so `python stats.py rebuild --fix` can correct them.
+    '''
+    SQLModel.metadata.create_all(engine)
+    duplicates = 'EXISTS (SELECT 1 FROM word AS kept WHERE kept.user_id = word.user_id AND kept.word = word.word AND kept.id < word.id)'
+    with engine.begin() as conn:
+        conn.execute(text(f'''
+            INSERT INTO reviewevent (user_id, word, kind, box_before, created_at)
+            SELECT user_id, word, 'deleted', box_number, :now FROM word
+            WHERE {duplicates} AND EXISTS (SELECT 1 FROM userstats WHERE userstats.user_id = word.user_id)
+        '''), {'now': datetime.utcnow()})
+        removed = conn.execute(text(f'DELETE FROM word WHERE {duplicates}')).rowcount
+        conn.execute(text('CREATE UNIQUE INDEX IF NOT EXISTS uq_word_user_id_word ON word (user_id, word)'))
+    if removed:
+        print(f'removed {removed} duplicate words; run `python stats.py rebuild --fix` to update the stats')
+
+
+if __name__ == '__main__':
+    engine = get_engine()
+    migrate_word_definitions(engine)
+    migrate_due_index(engine)
+    migrate_token_version(engine)
+    migrate_reminder_state(engine)
+    migrate_vocab_version(engine)
+    migrate_review_stats(engine)
+    migrate_unique_words(engine)
@@ -1,8 +1,8 @@
 from typing import Optional, List
-from sqlmodel import SQLModel, Field, Relationship, create_engine
-from datetime import datetime
+from sqlmodel import SQLModel, Field, Relationship
+from sqlalchemy import Index
+from datetime import datetime, date
 
-import os
 
 
 class User(SQLModel, table=True):
@@ -10,19 +10,92 @@ class User(SQLModel, table=True):
     username: str = Field(index=True) # creates an index for the username field for faster lookup time
     password_hash: str
     wants_updates: bool
+    token_version: int = Field(default=0) # bumped to revoke every token issued so far
+    reminded_at: Optional[datetime] = None # due time covered by the last reminder email
+    vocab_version: int = Field(default=0) # bumped whenever the user's words or preferences change; ETags are derived from it
 
     words: List['Word'] = Relationship(back_populates='user')
 
+class Definition(SQLModel, table=True):
+    '''
+    Shared cache of dictionary lookups, keyed by the normalised (lower-case) word.
+    definition holds the clean_dict output as JSON, or None if the dictionary had no results.
+    '''
+    id: Optional[int] = Field(default=None, primary_key=True)
+    word: str = Field(index=True, unique=True)
+    definition: Optional[str] = None
+    fetched_at: datetime
+
 class Word(SQLModel, table=True):
+    __table_args__ = (
+        # Serves the "which of this user's words are due" queries behind /check, /getwords and the reminder emails
+        Index('ix_word_user_id_next_review_date', 'user_id', 'next_review_date'),
+        # A user has each word at most once; adding a word is an INSERT ... ON CONFLICT DO NOTHING against this
+        Index('uq_word_user_id_word', 'user_id', 'word', unique=True),
+    )
+
     id: Optional[int] = Field(default=None, primary_key=True)
     word: str = Field(index=True) 
-    definition: str
+    definition_id: Optional[int] = Field(default=None, foreign_key="definition.id", index=True) # shared with every other user who has this word
     box_number: int
     last_reviewed_date: datetime
-    next_review_date: datetime
+    next_review_date: datetime = Field(index=True) # lets the reminder job find words that became due since its last run
 
     user_id: int = Field(default=None, foreign_key="user.id")
     user: Optional[User] = Relationship(back_populates='words')
+    entry: Optional[Definition] = Relationship()
+
+class SchedulerLease(SQLModel, table=True):
+    '''
+    Lets one worker at a time run a scheduled job; holder owns the lease until expires_at.
+    watermark records how far the job has got, e.g. the due time up to which reminders have been sent.
+    '''
+    name: str = Field(primary_key=True)
+    holder: Optional[str] = None
+    expires_at: datetime
+    watermark: Optional[datetime] = None
+
+class ReviewEvent(SQLModel, table=True):
+    '''
+    Append-only log of changes to users' words: kind is 'added', 'reviewed' or 'deleted'.
+    UserStats and DailyReviews can always be recomputed from it (see stats.py).
+    '''
+    __table_args__ = (Index('ix_reviewevent_user_id_id', 'user_id', 'id'),)
+
+    id: Optional[int] = Field(default=None, primary_key=True)
+    user_id: int = Field(foreign_key="user.id")
+    word: str
+    kind: str
+    box_before: Optional[int] = None
+    box_after: Optional[int] = None
+    is_correct: Optional[bool] = None
+    created_at: datetime
 
+class UserStats(SQLModel, table=True):
+    '''
+    Per-user running totals, updated in the same transaction as the change to the user's words,
+    so reading them costs the same however many words the user has.
+    '''
+    user_id: int = Field(primary_key=True, foreign_key="user.id")
+    words: int = Field(default=0)
+    reviews: int = Field(default=0)
+    correct: int = Field(default=0)
+    box_1: int = Field(default=0)
+    box_2: int = Field(default=0)
+    box_3: int = Field(default=0)
+    box_4: int = Field(default=0)
+    box_5: int = Field(default=0)
+    box_6: int = Field(default=0)
+    box_7: int = Field(default=0)
+    box_8: int = Field(default=0)
+    box_9: int = Field(default=0)
+    box_10: int = Field(default=0)
+    current_streak: int = Field(default=0) # consecutive days with a review, ending on last_review_day
+    longest_streak: int = Field(default=0)
+    last_review_day: Optional[date] = None
 
-engine = create_engine(os.getenv("DATABASE_URL"))
\ No newline at end of file
+class DailyReviews(SQLModel, table=True):
+    user_id: int = Field(primary_key=True, foreign_key="user.id")
+    day: date = Field(primary_key=True)
+    reviews: int = Field(default=0)
+    correct: int = Field(default=0)
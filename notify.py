@@ -0,0 +1,104 @@
+from datetime import datetime
+import asyncio
+import heapq
+import os
+
+
+# Idle connections are sent a comment this often so proxies don't close them (Heroku's router gives up after 55s)
+HEARTBEAT_SECONDS = float(os.getenv('EVENTS_HEARTBEAT_SECONDS', 25))
+# How often a connection re-reads the user's state anyway, to pick up changes made on other workers
+RECHECK_SECONDS = float(os.getenv('EVENTS_RECHECK_SECONDS', 300))
+# Wake a little after the due time, so the due summary computed on waking already counts the word
+DUE_SLACK_SECONDS = 0.05
+
+
+class DueNotifier():
+    '''
+    Lets long-lived /events/due connections sleep until there's something to tell them.
+    A connection waits until its user's next word falls due, until notify() is called because the user's
+    words changed on this worker, or until the next heartbeat, whichever comes first.
+    Every due time on the worker shares one timer (for the earliest), and every connection shares one
+    heartbeat timer, so idle connections cost no CPU between wake-ups.
+    Must only be used from the event loop thread.
+    '''
+
+    def __init__(self, heartbeat=HEARTBEAT_SECONDS):
+        self.heartbeat = heartbeat
+        self._waiters = {} # user_id -> set of futures, one per waiting connection
+        self._deadlines = [] # heap of (loop time, user_id)
+        self._scheduled = {} # user_id -> (loop time, due time) of their earliest deadline in the heap
+        self._due_timer = None
+        self._due_timer_at = None
+        self._heartbeat_timer = None
+
+    @property
+    def connections(self):
+        return sum(len(futures) for futures in self._waiters.values())
+
+    def _wake(self, user_id: int, reason: str):
+        for future in self._waiters.get(user_id, ()):
+            if not future.done():
+                future.set_result(reason)
+
+    def notify(self, user_id: int):
+        '''
+        Wakes the user's connections because their words changed.
+        '''
+        self._wake(user_id, 'changed')
+
+    def _fire_due(self):
+        self._due_timer = None
+        self._due_timer_at = None
+        now = asyncio.get_running_loop().time()
+        while self._deadlines and self._deadlines[0][0] <= now:
+            _, user_id = self._pop_deadline()
+            self._wake(user_id, 'due')
+        self._schedule_due()
+
+    def _pop_deadline(self):
+        when, user_id = heapq.heappop(self._deadlines)
+        if user_id in self._scheduled and self._scheduled[user_id][0] == when:
+            del self._scheduled[user_id]
+        return when, user_id
+
+    def _schedule_due(self):
+        # Deadlines of users with no connections left are dropped rather than woken for
+        while self._deadlines and self._deadlines[0][1] not in self._waiters:
+            self._pop_deadline()
+        if not self._deadlines:
+            return
+        when = self._deadlines[0][0]
+        if self._due_timer is not None:
+            if self._due_timer_at <= when:
+                return
+            self._due_timer.cancel()
+        self._due_timer = asyncio.get_running_loop().call_at(when, self._fire_due)
+        self._due_timer_at = when
+
+    def _beat(self):
+        self._heartbeat_timer = None
+        for user_id in list(self._waiters):
+            self._wake(user_id, 'heartbeat')
+
+    async def wait(self, user_id: int, next_due: datetime = None):
+        '''
+        Returns why the connection was woken: 'due', 'changed' or 'heartbeat'.
+        '''
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._waiters.setdefault(user_id, set()).add(future)
+        # Connections re-wait after every heartbeat, so a deadline is only added if the user doesn't already have an earlier one
+        if next_due is not None and (user_id not in self._scheduled or next_due < self._scheduled[user_id][1]):
+            when = loop.time() + max((next_due - datetime.utcnow()).total_seconds(), 0) + DUE_SLACK_SECONDS
+            heapq.heappush(self._deadlines, (when, user_id))
+            self._scheduled[user_id] = (when, next_due)
+            self._schedule_due()
+        if self._heartbeat_timer is None:
+            self._heartbeat_timer = loop.call_later(self.heartbeat, self._beat)
+        try:
+            return await future
+        finally:
+            futures = self._waiters[user_id]
+            futures.discard(future)
+            if not futures:
+                del self._waiters[user_id]
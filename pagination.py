@@ -0,0 +1,66 @@
+from datetime import datetime
+from fastapi import HTTPException
+from sqlalchemy import tuple_
+from models import Word
+import base64
+import json
+import os
+
+
+PAGE_SIZE = int(os.getenv('PAGE_SIZE', 100))
+MAX_PAGE_SIZE = int(os.getenv('MAX_PAGE_SIZE', 500))
+
+# Words are always listed in this order; id breaks ties so that every word has a unique position
+WORD_ORDER = (Word.next_review_date, Word.last_reviewed_date, Word.id)
+
+
+def page_size(limit: int = None):
+    '''
+    Returns the requested page size, falling back to PAGE_SIZE and capped at MAX_PAGE_SIZE.
+    '''
+    if not limit or limit < 1:
+        return PAGE_SIZE
+    return min(limit, MAX_PAGE_SIZE)
+
+
+def encode_cursor(word: Word):
+    '''
+    Returns an opaque cursor pointing just after word in WORD_ORDER.
+    '''
+    position = [word.next_review_date.isoformat(), word.last_reviewed_date.isoformat(), word.id]
+    return base64.urlsafe_b64encode(json.dumps(position).encode()).decode()
+
+
+def after_cursor(cursor: str):
+    '''
+    Returns the SQL condition selecting the words after the cursor, so a page is an index seek rather than an OFFSET scan.
+    Raises a 400 if the cursor wasn't produced by encode_cursor.
+    '''
+    try:
+        next_review, last_reviewed, word_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        position = (datetime.fromisoformat(next_review), datetime.fromisoformat(last_reviewed), int(word_id))
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail='Invalid cursor')
+    return tuple_(*WORD_ORDER) > tuple_(*position)
+
+
+def paginate(query, cursor: str = None, limit: int = None):
+    '''
+    Orders a select() of Word by WORD_ORDER and restricts it to one page after the cursor.
+    One extra row is fetched so the caller can tell whether there is a next page (see split_page).
+    '''
+    if cursor:
+        query = query.where(after_cursor(cursor))
+    return query.order_by(*WORD_ORDER).limit(page_size(limit) + 1)
+
+
+def split_page(rows: list, limit: int = None, key=None):
+    '''
+    Returns (the rows in the page, the cursor for the next page or None if this is the last one).
+    key picks the Word out of each row when the query selected more than just Word.
+    '''
+    size = page_size(limit)
+    if len(rows) > size:
+        last = rows[size - 1]
+        return rows[:size], encode_cursor(key(last) if key else last)
+    return rows, None
@@ -0,0 +1,135 @@
+'''
+Server-side review sessions: the order in which a user's due words are handed out for revision.
+
+Starting a session reads just the ids and review dates of the user's due words and sorts them by priority.
+The words themselves (with their definitions) are loaded a small batch at a time, as the client asks for them,
+so a user with hundreds of words due gets their first word as quickly as one with ten.
+
+Sessions live in the memory of the worker that started them and are dropped after REVIEW_SESSION_IDLE_SECONDS
+without a request. A request that finds no session (e.g. it reached another worker) simply starts a new one,
+leaving out the words the client says it already holds.
+'''
+from collections import OrderedDict
+from datetime import datetime
+from sqlmodel import select
+from models import Word, Definition
+from due import is_due
+import threading
+import time
+import os
+
+
+REVIEW_BATCH_SIZE = int(os.getenv('REVIEW_BATCH_SIZE', 10))
+MAX_REVIEW_BATCH_SIZE = 50
+REVIEW_SESSION_IDLE_SECONDS = float(os.getenv('REVIEW_SESSION_IDLE_SECONDS', 30 * 60))
+MAX_REVIEW_SESSIONS = int(os.getenv('MAX_REVIEW_SESSIONS', 10000))
+
+
+def priority(box_number: int, last_reviewed_date: datetime, next_review_date: datetime, now: datetime):
+    '''
+    Sort key for a due word: most overdue first, measured against the word's own review interval,
+    so a word a day late in box 1 (a one-day interval) comes before a word a day late in box 6.
+    Ties go to the lower box, whose words are the least well known.
+    '''
+    interval = max((next_review_date - last_reviewed_date).total_seconds(), 1)
+    overdue = (now - next_review_date).total_seconds() / interval
+    return (-overdue, box_number)
+
+
+class ReviewSession():
+    '''
+    One user's queue of due word ids, in priority order, and the ids already handed out in this session.
+    '''
+
+    def __init__(self, user_id: int):
+        self.user_id = user_id
+        self.queue = []
+        self.position = 0
+        self.served = set()
+        self.due_count = 0
+        self.last_used = time.monotonic()
+
+    @property
+    def remaining(self):
+        return len(self.queue) - self.position
+
+    async def fill(self, session, now: datetime):
+        '''
+        Queues every due word that hasn't been handed out yet in this session, in priority order.
+        Called when the session starts and again when its queue runs out, to pick up words that fell due meanwhile.
+        '''
+        rows = (await session.exec(select(Word.id, Word.box_number, Word.last_reviewed_date, Word.next_review_date).where(is_due(self.user_id, now)))).all()
+        rows = [row for row in rows if row[0] not in self.served]
+        rows.sort(key=lambda row: priority(row[1], row[2], row[3], now))
+        self.queue = [row[0] for row in rows]
+        self.position = 0
+        self.due_count = max(self.due_count, len(self.served) + len(self.queue))
+
+    async def next_batch(self, session, size: int = REVIEW_BATCH_SIZE, now: datetime = None):
+        '''
+        Returns the next `size` due words with their definitions, as (Word, definition JSON) rows.
+        Words that stopped being due since the queue was filled (reviewed in another tab, or deleted) are skipped.
+        '''
+        now = now or datetime.utcnow()
+        batch = []
+        while len(batch) < size:
+            if self.remaining == 0:
+                await self.fill(session, now)
+                if self.remaining == 0:
+                    break
+            # Ids are claimed before the query awaits, so a concurrent request for the same session moves on to the next ones
+            ids = self.queue[self.position:self.position + size - len(batch)]
+            self.position += len(ids)
+            self.served.update(ids)
+            rows = (await session.exec(select(Word, Definition.definition)
+                .join(Definition, Word.definition_id == Definition.id, isouter=True)
+                .where(is_due(self.user_id, now), Word.id.in_(ids)))).all()
+            by_id = {row[0].id: row for row in rows}
+            batch += [by_id[word_id] for word_id in ids if word_id in by_id]
+        self.last_used = time.monotonic()
+        return batch
+
+
+class ReviewSessions():
+    '''
+    The review sessions on this worker, at most one per user, least recently used first.
+    Sessions idle for longer than idle_seconds are evicted, as are the oldest once there are more than max_sessions.
+    '''
+
+    def __init__(self, idle_seconds=REVIEW_SESSION_IDLE_SECONDS, max_sessions=MAX_REVIEW_SESSIONS):
+        self.idle_seconds = idle_seconds
+        self.max_sessions = max_sessions
+        self._sessions = OrderedDict() # user_id -> ReviewSession
+        self._lock = threading.Lock()
+        self.evicted = 0
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def get(self, user_id: int, restart: bool = False, exclude=()):
+        '''
+        Returns the user's session, starting a new one if asked to or if they don't have one on this worker.
+        A new session counts the word ids in exclude as already handed out.
+        '''
+        with self._lock:
+            self._evict_idle()
+            review_session = None if restart else self._sessions.get(user_id)
+            if review_session is None:
+                review_session = ReviewSession(user_id)
+                review_session.served.update(exclude)
+                self._sessions[user_id] = review_session
+            self._sessions.move_to_end(user_id)
+            review_session.last_used = time.monotonic()
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+                self.evicted += 1
+            return review_session
+
+    def _evict_idle(self):
+        cutoff = time.monotonic() - self.idle_seconds
+        while self._sessions:
+            user_id, review_session = next(iter(self._sessions.items()))
+            if review_session.last_used > cutoff:
+                break
+            del self._sessions[user_id]
+            self.evicted += 1
@@ -0,0 +1,119 @@
+'''
+Batched spaced-repetition scheduling and review-load forecasting.
+
+update_boxes applies the same algorithm as helpers.update_box to arrays of words at once.
+forecast_reviews projects how many reviews will fall due on each of the next N days, for one user
+or the whole system, starting from the current distribution of words over boxes and due dates.
+
+    DATABASE_URL=... python scheduling.py --days 30 [--user-id 1] [--accuracy 0.8]
+'''
+from datetime import datetime
+from sqlalchemy import func
+from sqlmodel import Session, select
+from models import Word
+from helpers import NEXT_INTERVAL, REDUCE_BOX, MAX_BOX
+import numpy as np
+import argparse
+
+
+# Array versions of the lookup tables, indexed by box number (box 0 is unused)
+INTERVALS = np.array([0] + NEXT_INTERVAL[1:], dtype=np.int64)
+REDUCTIONS = np.array([0] + REDUCE_BOX[1:], dtype=np.int64)
+BOXES = np.arange(1, MAX_BOX + 1)
+
+
+def next_boxes(current_boxes, is_correct):
+    '''
+    Returns the box each word moves to, exactly as update_box would choose it.
+    '''
+    boxes = np.asarray(current_boxes, dtype=np.int64)
+    correct = np.asarray(is_correct, dtype=bool)
+    if boxes.size and (boxes.min() < 1 or boxes.max() > MAX_BOX):
+        raise ValueError(f'Box numbers must be between 1 and {MAX_BOX}')
+    return np.where(correct, np.minimum(boxes + 1, MAX_BOX), boxes + REDUCTIONS[boxes])
+
+
+def update_boxes(current_boxes, is_correct, now: datetime = None):
+    '''
+    Vectorised update_box: takes arrays of current boxes and correctness flags and returns
+    (new boxes, last reviewed date, array of next review dates as datetime64[us]).
+    For the same now, element i matches update_box(current_boxes[i], is_correct[i], now).
+    '''
+    now = now or datetime.utcnow()
+    new_boxes = next_boxes(current_boxes, is_correct)
+    next_review_dates = np.datetime64(now, 'us') + INTERVALS[new_boxes].astype('timedelta64[D]')
+    return new_boxes, now, next_review_dates
+
+
+def forecast_reviews(boxes, due_dates, days: int = 30, accuracy: float = 0.8, counts=None, today=None):
+    '''
+    Returns an array with the expected number of reviews on each of the next `days` days (index 0 is today).
+    boxes and due_dates describe the words (or groups of words, weighted by counts); overdue words count as due today.
+    Each day's reviews are assumed to be answered correctly with probability `accuracy` and rescheduled by update_box,
+    so the projection includes the reviews that today's reviews will generate later on.
+    '''
+    today = np.datetime64(today or datetime.utcnow().date(), 'D')
+    boxes = np.asarray(boxes, dtype=np.int64)
+    counts = np.ones(len(boxes)) if counts is None else np.asarray(counts, dtype=float)
+    due_days = np.maximum((np.asarray(due_dates, dtype='datetime64[D]') - today).astype(np.int64), 0)
+
+    # state[box, day] -> expected number of words in box that fall due on day
+    state = np.zeros((MAX_BOX + 1, days))
+    in_range = due_days < days
+    np.add.at(state, (boxes[in_range], due_days[in_range]), counts[in_range])
+
+    promoted = next_boxes(BOXES, np.ones(len(BOXES), dtype=bool))
+    demoted = next_boxes(BOXES, np.zeros(len(BOXES), dtype=bool))
+
+    reviews = np.zeros(days)
+    for day in range(days):
+        reviewed = state[1:, day]
+        reviews[day] = reviewed.sum()
+        if not reviews[day]:
+            continue
+        for targets, share in ((promoted, accuracy), (demoted, 1 - accuracy)):
+            target_days = day + INTERVALS[targets]
+            in_range = target_days < days
+            np.add.at(state, (targets[in_range], target_days[in_range]), reviewed[in_range] * share)
+    return reviews
+
+
+def load_due_distribution(session, user_id: int = None):
+    '''
+    Returns (boxes, due dates, counts): the number of words in each box due on each date, aggregated in SQL
+    so that only one row per (box, date) leaves the database. Covers every user unless user_id is given.
+    '''
+    due_date = func.date(Word.next_review_date)
+    query = select(Word.box_number, due_date, func.count(Word.id)).group_by(Word.box_number, due_date)
+    if user_id is not None:
+        query = query.where(Word.user_id == user_id)
+    rows = session.exec(query).all()
+
+    boxes = np.array([row[0] for row in rows], dtype=np.int64)
+    # SQLite returns dates as 'YYYY-MM-DD' strings and Postgres as date objects; numpy parses both
+    due_dates = np.array([str(row[1]) for row in rows], dtype='datetime64[D]')
+    counts = np.array([row[2] for row in rows], dtype=float)
+    return boxes, due_dates, counts
+
+
+def main():
+    from database import get_engine
+
+    parser = argparse.ArgumentParser(description='Projects the number of reviews due on each of the next N days.')
+    parser.add_argument('--days', type=int, default=30)
+    parser.add_argument('--user-id', type=int, default=None, help='forecast one user instead of the whole system')
+    parser.add_argument('--accuracy', type=float, default=0.8, help='share of reviews assumed to be answered correctly')
+    args = parser.parse_args()
+
+    with Session(get_engine()) as session:
+        boxes, due_dates, counts = load_due_distribution(session, args.user_id)
+
+    today = datetime.utcnow().date()
+    reviews = forecast_reviews(boxes, due_dates, args.days, args.accuracy, counts, today)
+    for day, expected in zip(np.datetime64(today, 'D') + np.arange(args.days), reviews):
+        print(f'{day}  {expected:10.1f}')
+    print(f'total  {reviews.sum():10.1f}')
+
+
+if __name__ == '__main__':
+    main()
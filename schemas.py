@@ -1,4 +1,5 @@
 from pydantic import BaseModel
+from typing import List
 
 
 '''
@@ -18,5 +19,8 @@ class WordDetails(BaseModel):
     current_box: int
     is_correct: bool
 
+class WordDetailsBatch(BaseModel):
+    words: List[WordDetails]
+
 class DeleteWord(BaseModel):
     word: str
\ No newline at end of file
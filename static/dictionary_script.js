@@ -77,6 +77,14 @@ document.addEventListener("DOMContentLoaded", function() {
     lookupButton.addEventListener("click", lookupWord);
     document.getElementById('logout-button').addEventListener("click", logout);
 
+    function showDueWords(response) {
+        if (response.revision_time) {
+            // If it's time to revise, enable the revise button
+            document.getElementById('revise-button').disabled = false;
+            nWords.innerHTML = 'You have ' + response.due_count + (response.due_count == 1 ? ' word' : ' words') + ' to revise!'
+        } 
+    }
+
     function checkForWords() {
         fetch('/check', {
             method: 'GET',
@@ -86,13 +94,16 @@ document.addEventListener("DOMContentLoaded", function() {
             credentials: 'same-origin' 
         })
         .then(response => response.json())
-        .then(response => {
-            if (response.revision_time) {
-                // If it's time to revise, enable the revise button
-                document.getElementById('revise-button').disabled = false;
-                nWords.innerHTML = 'You have words to revise!'
-            } 
+        .then(showDueWords);
+    }
+
+    if (window.EventSource) {
+        // The server pushes an update when words fall due or the list changes, so there's nothing to poll
+        var dueEvents = new EventSource('/events/due');
+        dueEvents.addEventListener('due', function(event) {
+            showDueWords(JSON.parse(event.data));
         });
+    } else {
+        checkForWords()
     }
-    checkForWords()
 });
\ No newline at end of file
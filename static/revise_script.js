@@ -9,13 +9,31 @@ document.addEventListener("DOMContentLoaded", function() {
     var nWords = document.getElementById("n-words");
     var letter_counter_locked = true;
     var currentWordIndex = 0;
-    var words;
+    var words = [];
+    // Due words are handed out a small batch at a time by the server's review queue, most overdue first;
+    // the next batch is fetched in the background before the current one runs out
+    var moreWords = true;
+    var batchRequest = null;
+    var totalWords = 0;
+    var PREFETCH_WHEN_LEFT = 5;
+    // Answers are buffered and sent to '/updatebatch' in groups rather than one request per word
+    var pendingResults = [];
+    var FLUSH_EVERY = 10;
 
     submitAnswerButton.disabled = true;
     notSureButton.disabled = true;
 
-    async function getWords() {
-        await fetch('/getwords', {
+    async function getWords(start=false) {
+        var requestUrl = start ? '/review/next?start=true' : '/review/next';
+        if (!start) {
+            // The words not yet answered; if this request reaches a worker that doesn't have our review session,
+            // the new session it starts leaves them out instead of handing them out again
+            var held = words.slice(currentWordIndex).map(word => 'exclude=' + word.id);
+            if (held.length) {
+                requestUrl += '?' + held.join('&');
+            }
+        }
+        await fetch(requestUrl, {
             method: 'GET',
             headers: {
                 'Content-Type': 'application/json',
@@ -25,15 +43,31 @@ document.addEventListener("DOMContentLoaded", function() {
         .then(response => response.json())
         .then(data => {
             if (data.words) {
-                words = data.words;
+                // Skip any word we already have, in case a new session handed it out again anyway
+                var ids = new Set(words.map(word => word.id));
+                words = words.concat(data.words.filter(word => !ids.has(word.id)));
+                // An empty batch means the session is over
+                moreWords = data.words.length > 0;
+                totalWords = Math.max(totalWords, data.due_count, words.length);
             } 
             else {
                 console.log('No words found.');
+                moreWords = false;
             }
         });
         return words;
     }
 
+    function loadNextBatch() {
+        // Only one batch request at a time; callers share the one in progress.
+        // Buffered answers are sent first: once they're saved those words are no longer due,
+        // so a session started on another worker won't hand them out again either
+        if (!batchRequest && moreWords) {
+            batchRequest = flushResults().then(() => getWords()).finally(() => { batchRequest = null; });
+        }
+        return batchRequest || Promise.resolve(words);
+    }
+
     function sleep(ms) {
         return new Promise(resolve => setTimeout(resolve, ms));
     }
@@ -64,9 +98,8 @@ document.addEventListener("DOMContentLoaded", function() {
         }
     });
 
-    getWords().then(receivedWords => {
-        words = receivedWords
-        nWords.innerHTML = (words.length - currentWordIndex) + ' words to revise'
+    getWords(true).then(receivedWords => {
+        nWords.innerHTML = (totalWords - currentWordIndex) + ' words to revise'
     });
 
     function getWord() {
@@ -87,7 +120,7 @@ document.addEventListener("DOMContentLoaded", function() {
         messageDiv.innerHTML = currentWord.word.length + ' letters'
         letter_counter_locked = false;
 
-        var definitionsPOS = JSON.parse(currentWord.definition)
+        var definitionsPOS = currentWord.definition
 
         // Iterate through the definitions
         for (var partOfSpeech in definitionsPOS) {
@@ -178,10 +211,19 @@ document.addEventListener("DOMContentLoaded", function() {
         // Move to the next word
         currentWordIndex++;
 
-        nWords.innerHTML = (words.length - currentWordIndex) + ' words to revise'
+        nWords.innerHTML = (totalWords - currentWordIndex) + ' words to revise'
+
+        if (words.length - currentWordIndex <= PREFETCH_WHEN_LEFT) {
+            loadNextBatch();
+        }
+        // If the next batch is still on its way, wait for it before deciding that we're done
+        if (currentWordIndex == words.length) {
+            await loadNextBatch();
+        }
     
         // Check if all words have been tested
         if (currentWordIndex == words.length) {
+            flushResults();
             getWordButton.disabled = true;
             await sleep(3000); // Wait 3 seconds to ensure the user had time to read the correct/incorrect message
             messageDiv.innerHTML = "That's all for now!";
@@ -196,26 +238,54 @@ document.addEventListener("DOMContentLoaded", function() {
     }
 
     function update(word, userId, currentBox, isCorrect) {
-        // The '/update' endpoint updates the box_number, last_reviewed_date, and next_review_date in the SQL database, depending on whether answer was correct or not.
-        var requestUrl = '/update';
+        // Queues the result; the '/updatebatch' endpoint updates the box_number, last_reviewed_date, and next_review_date in the SQL database, depending on whether answer was correct or not.
+        pendingResults.push({
+            word: word,
+            user_id: userId,
+            current_box: currentBox,
+            is_correct: isCorrect
+        });
+        if (pendingResults.length >= FLUSH_EVERY) {
+            flushResults();
+        }
+    }
 
-        console.log(typeof(word), typeof(userId), typeof(currentBox), typeof(isCorrect))
-      
-        fetch(requestUrl, {
+    function flushResults() {
+        // Returns a promise that settles once the answers have been saved (or failed to be)
+        if (pendingResults.length == 0) {
+            return Promise.resolve();
+        }
+        var results = pendingResults;
+        pendingResults = [];
+
+        return fetch('/updatebatch', {
           method: 'POST',
           headers: {
             'Content-Type': 'application/json',
           },
-          body: JSON.stringify({
-            word: word,
-            user_id: userId,
-            current_box: currentBox,
-            is_correct: isCorrect
-          }),
-          credentials: 'same-origin' // Include cookies in the request
+          body: JSON.stringify({words: results}),
+          credentials: 'same-origin', // Include cookies in the request
+          keepalive: true // Lets the request finish if it was sent as the page is closing
+        })
+        .then(response => response.json())
+        .then(response => {
+            if (response.rejected && response.rejected.length) {
+                console.log('Rejected results for:', response.rejected);
+            }
         })
+        .catch((error) => {
+            console.error('Error:', error);
+        });
     }
 
+    // Send any buffered answers before the user leaves the page
+    window.addEventListener('pagehide', flushResults);
+    document.addEventListener('visibilitychange', function() {
+        if (document.visibilityState == 'hidden') {
+            flushResults();
+        }
+    });
+
 
     function logout() {
         fetch('/logout', {
@@ -38,13 +38,104 @@ document.addEventListener("DOMContentLoaded", function() {
 
     document.getElementById('change-preference').addEventListener('click', changePreference);
 
-    var elements = Array.from(document.getElementsByClassName('delete-button'));
+    // Takes in two dates and returns the difference as a string -> 'X days, Y hours, Z minutes' (see helpers.days_hours_mins)
+    function daysHoursMins(end, start, isLast=false) {
+        var minutes = Math.floor((end - start) / 60000);
+        if (minutes < 1) {
+            return isLast ? 'Just now' : 'Now!';
+        }
+        var time = {days: Math.floor(minutes / 1440), hours: Math.floor(minutes / 60) % 24, minutes: minutes % 60};
+        var string = '';
+        for (var unit in time) {
+            if (time[unit] > 0 || string) string += time[unit] + ' ' + unit + ' ';
+        }
+        return string;
+    }
+
+    function relativeTime(timestamp, isLast) {
+        var now = new Date();
+        var time = new Date(timestamp);
+        return isLast ? daysHoursMins(now, time, true) : daysHoursMins(time, now);
+    }
+
+    // The page is cached between visits, so times are rendered as timestamps and shown relative to now here
+    Array.from(document.getElementsByClassName('relative-time')).forEach(cell => {
+        cell.innerText = relativeTime(cell.dataset.time, cell.dataset.last == 'true');
+    });
+
+    var wordsBody = document.getElementById('words-body');
+    var loadMore = document.getElementById('load-more');
+    var nextCursor = loadMore.dataset.nextCursor;
+    var loading = false;
+
+    // Listen on the table body so that rows loaded later get working delete buttons too
+    wordsBody.addEventListener('click', function(event) {
+        var button = event.target.closest('.delete-button');
+        if (button) {
+            deleteWord(button);
+        }
+    });
+
+    function addRow(word) {
+        var row = document.createElement('tr');
+        [word.word, word.box_number, relativeTime(word.last_reviewed, true), relativeTime(word.next_review, false)].forEach(value => {
+            var cell = document.createElement('td');
+            cell.innerText = value;
+            row.appendChild(cell);
+        });
+
+        var deleteCell = document.createElement('td');
+        deleteCell.className = 'delete-cell';
+        var button = document.createElement('button');
+        button.className = 'delete-button';
+        button.value = word.word;
+        button.innerHTML = '<b>Delete</b>';
+        deleteCell.appendChild(button);
+        row.appendChild(deleteCell);
+
+        wordsBody.appendChild(row);
+    }
 
-    elements.forEach(element => {
-        element.addEventListener('click', function() {
-            deleteWord(element);
+    function loadNextPage() {
+        if (!nextCursor || loading) {
+            return;
+        }
+        loading = true;
+
+        fetch('/words/page?' + new URLSearchParams({cursor: nextCursor}), {
+            method: 'GET',
+            headers: {
+                'Content-Type': 'application/json',
+            },
+            credentials: 'same-origin' 
+        })
+        .then(response => response.json())
+        .then(data => {
+            data.words.forEach(addRow);
+            nextCursor = data.next_cursor;
+            loading = false;
+            if (!nextCursor) {
+                observer.disconnect();
+            } else if (loadMore.getBoundingClientRect().top < window.innerHeight + 400) {
+                // The observer won't fire again while the marker stays in view, e.g. on tall screens
+                loadNextPage();
+            }
         })
-    })
+        .catch((error) => {
+            loading = false;
+            console.error('Error:', error);
+        });
+    }
+
+    // Load the next page of words as the user scrolls towards the bottom of the list
+    var observer = new IntersectionObserver(entries => {
+        if (entries.some(entry => entry.isIntersecting)) {
+            loadNextPage();
+        }
+    }, {rootMargin: '400px'});
+    if (nextCursor) {
+        observer.observe(loadMore);
+    }
 
     function deleteWord(button) {
         let word = button.value;
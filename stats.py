@@ -0,0 +1,276 @@
+'''
+Per-user statistics: words per box, reviews per day, accuracy and streaks.
+
+Every change to a user's words is described by review events ('added', 'reviewed', 'deleted').
+The endpoints apply the events to the user's UserStats and DailyReviews rows in the same transaction as the change,
+then hand them to ReviewLog, which appends them to the review_event table in batches.
+Reading the stats is two primary-key lookups, however many words the user has.
+
+To check (or, with --fix, repair) the aggregates against the log:
+
+    DATABASE_URL=... python stats.py rebuild [--user-id 1] [--fix]
+'''
+from collections import defaultdict
+from datetime import datetime, date, timedelta
+from sqlalchemy import case, delete, insert
+from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
+from models import ReviewEvent, UserStats, DailyReviews
+from database import get_async_engine, insert_for
+import argparse
+import asyncio
+import os
+
+
+BOXES = range(1, 11)
+STATS_DAYS = int(os.getenv('STATS_DAYS', 30))
+LOG_FLUSH_SIZE = int(os.getenv('REVIEW_LOG_FLUSH_SIZE', 500))
+LOG_FLUSH_SECONDS = float(os.getenv('REVIEW_LOG_FLUSH_SECONDS', 2))
+# If the database is unreachable for long, the oldest buffered events are dropped beyond this many
+LOG_MAX_BUFFER = int(os.getenv('REVIEW_LOG_MAX_BUFFER', 100000))
+
+
+def review_event(user_id: int, word: str, kind: str, box_before: int = None, box_after: int = None, is_correct: bool = None, now: datetime = None):
+    return {
+        'user_id': user_id,
+        'word': word,
+        'kind': kind,
+        'box_before': box_before,
+        'box_after': box_after,
+        'is_correct': is_correct,
+        'created_at': now or datetime.utcnow(),
+    }
+
+
+def aggregate(events):
+    '''
+    Returns the change a list of one user's events makes to their totals, box counts and daily reviews.
+    '''
+    totals = {'words': 0, 'reviews': 0, 'correct': 0, 'boxes': defaultdict(int), 'days': defaultdict(lambda: [0, 0])}
+    for event in events:
+        if event['kind'] == 'added':
+            totals['words'] += 1
+        elif event['kind'] == 'deleted':
+            totals['words'] -= 1
+        elif event['kind'] == 'reviewed':
+            totals['reviews'] += 1
+            totals['correct'] += bool(event['is_correct'])
+            day = totals['days'][event['created_at'].date()]
+            day[0] += 1
+            day[1] += bool(event['is_correct'])
+        if event['box_before']:
+            totals['boxes'][event['box_before']] -= 1
+        if event['box_after']:
+            totals['boxes'][event['box_after']] += 1
+    return totals
+
+
+def streaks(review_days):
+    '''
+    Returns (current streak, longest streak, last review day) for a sorted list of the days with reviews.
+    The current streak is the run of consecutive days ending on the last review day.
+    '''
+    current = longest = 0
+    previous = None
+    for day in review_days:
+        current = current + 1 if previous is not None and day - previous == timedelta(days=1) else 1
+        longest = max(longest, current)
+        previous = day
+    return current, longest, previous
+
+
+async def apply_events(session, user_id: int, events: list):
+    '''
+    Adds the events' changes to the user's UserStats and DailyReviews rows, creating them if needed.
+    Each row is changed with a single INSERT ... ON CONFLICT DO UPDATE of relative increments,
+    so concurrent requests for the same user can't overwrite each other's counts.
+    '''
+    if not events:
+        return
+    totals = aggregate(events)
+    insert_stats = insert_for(session.bind)
+
+    values = {'words': totals['words'], 'reviews': totals['reviews'], 'correct': totals['correct']}
+    values.update({f'box_{box}': change for box, change in totals['boxes'].items()})
+    updates = {column: getattr(UserStats, column) + change for column, change in values.items() if change}
+
+    if totals['days']:
+        # Requests only ever log reviews for the current day
+        day = max(totals['days'])
+        current = case(
+            (UserStats.last_review_day == day, UserStats.current_streak),
+            (UserStats.last_review_day == day - timedelta(days=1), UserStats.current_streak + 1),
+            else_=1)
+        values.update(current_streak=1, longest_streak=1, last_review_day=day)
+        updates.update(
+            current_streak=current,
+            longest_streak=case((current > UserStats.longest_streak, current), else_=UserStats.longest_streak),
+            last_review_day=day)
+
+    statement = insert_stats(UserStats).values(user_id=user_id, **values)
+    if updates:
+        statement = statement.on_conflict_do_update(index_elements=['user_id'], set_=updates)
+    else:
+        statement = statement.on_conflict_do_nothing(index_elements=['user_id'])
+    await session.execute(statement)
+
+    for day, (reviews, correct) in totals['days'].items():
+        statement = insert_stats(DailyReviews).values(user_id=user_id, day=day, reviews=reviews, correct=correct)
+        await session.execute(statement.on_conflict_do_update(
+            index_elements=['user_id', 'day'],
+            set_={'reviews': DailyReviews.reviews + reviews, 'correct': DailyReviews.correct + correct}))
+
+
+async def read_stats(session, user_id: int, today: date = None, days: int = STATS_DAYS):
+    '''
+    Returns the user's stats, with their reviews for each of the last `days` days.
+    '''
+    today = today or datetime.utcnow().date()
+    stats = await session.get(UserStats, user_id) or UserStats(user_id=user_id)
+    since = today - timedelta(days=days - 1)
+    daily = {row.day: row for row in (await session.exec(select(DailyReviews).where(DailyReviews.user_id == user_id, DailyReviews.day >= since))).all()}
+
+    # The streak is broken once a whole day has gone by without a review
+    on_streak = stats.last_review_day is not None and stats.last_review_day >= today - timedelta(days=1)
+    return {
+        'words': stats.words,
+        'boxes': {box: getattr(stats, f'box_{box}') for box in BOXES},
+        'reviews': stats.reviews,
+        'correct': stats.correct,
+        'accuracy': stats.correct / stats.reviews if stats.reviews else None,
+        'current_streak': stats.current_streak if on_streak else 0,
+        'longest_streak': stats.longest_streak,
+        'reviews_per_day': [{
+            'day': day,
+            'reviews': daily[day].reviews if day in daily else 0,
+            'correct': daily[day].correct if day in daily else 0,
+        } for day in (since + timedelta(days=i) for i in range(days))],
+    }
+
+
+class ReviewLog():
+    '''
+    Buffers review events in memory and appends them to the review_event table with one multi-row INSERT
+    every flush_seconds, or as soon as flush_size events are waiting.
+    The aggregates are written with the change itself, so a crash can only lose the last few seconds of log;
+    `python stats.py rebuild` reports any user whose aggregates then disagree with it.
+    '''
+
+    def __init__(self, flush_size=LOG_FLUSH_SIZE, flush_seconds=LOG_FLUSH_SECONDS, max_buffer=LOG_MAX_BUFFER):
+        self.flush_size = flush_size
+        self.flush_seconds = flush_seconds
+        self.max_buffer = max_buffer
+        self._buffer = []
+        self._wakeup = None
+        self._task = None
+        self.written = 0
+        self.dropped = 0
+        self.failed_flushes = 0
+
+    def record(self, events: list):
+        self._buffer.extend(events)
+        if len(self._buffer) > self.max_buffer:
+            self.dropped += len(self._buffer) - self.max_buffer
+            del self._buffer[:len(self._buffer) - self.max_buffer]
+        if len(self._buffer) >= self.flush_size and self._wakeup is not None:
+            self._wakeup.set()
+
+    async def flush(self):
+        events, self._buffer = self._buffer, []
+        if not events:
+            return
+        try:
+            async with AsyncSession(get_async_engine()) as session:
+                await session.execute(insert(ReviewEvent), events)
+                await session.commit()
+            self.written += len(events)
+        except Exception as e:
+            # Put them back in front of anything recorded since, so the next flush retries them in order
+            self._buffer[:0] = events
+            self.failed_flushes += 1
+            print('review log flush failed:', e)
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.flush_seconds)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self.flush()
+
+    def start(self):
+        if self._task is None:
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
+    def stats(self):
+        return {'buffered': len(self._buffer), 'written': self.written, 'dropped': self.dropped, 'failed_flushes': self.failed_flushes}
+
+
+def rebuild_user(session, user_id: int, fix: bool = False):
+    '''
+    Recomputes the user's aggregates from their review events and compares them with the stored ones.
+    Returns a list of the differences; with fix=True the stored aggregates are replaced by the recomputed ones.
+    '''
+    events = [row.model_dump() for row in session.exec(select(ReviewEvent).where(ReviewEvent.user_id == user_id).order_by(ReviewEvent.id))]
+    totals = aggregate(events)
+    current, longest, last_day = streaks(sorted(totals['days']))
+    expected = {'words': totals['words'], 'reviews': totals['reviews'], 'correct': totals['correct'],
+                'current_streak': current, 'longest_streak': longest, 'last_review_day': last_day}
+    expected.update({f'box_{box}': totals['boxes'].get(box, 0) for box in BOXES})
+
+    stored = session.get(UserStats, user_id) or UserStats(user_id=user_id)
+    differences = [f'{column}: stored {getattr(stored, column)}, log says {value}' for column, value in expected.items() if getattr(stored, column) != value]
+    stored_days = {row.day: (row.reviews, row.correct) for row in session.exec(select(DailyReviews).where(DailyReviews.user_id == user_id))}
+    expected_days = {day: tuple(counts) for day, counts in totals['days'].items()}
+    differences += [f'{day}: stored {stored_days.get(day)}, log says {expected_days.get(day)}'
+                    for day in sorted(set(stored_days) | set(expected_days)) if stored_days.get(day) != expected_days.get(day)]
+
+    if fix and differences:
+        for column, value in expected.items():
+            setattr(stored, column, value)
+        session.add(stored)
+        session.execute(delete(DailyReviews).where(DailyReviews.user_id == user_id))
+        session.add_all(DailyReviews(user_id=user_id, day=day, reviews=reviews, correct=correct) for day, (reviews, correct) in expected_days.items())
+        session.commit()
+    return differences
+
+
+def main():
+    from sqlmodel import Session
+    from models import User
+    from database import get_engine
+
+    parser = argparse.ArgumentParser(description='Recomputes per-user stats from the review event log.')
+    subcommands = parser.add_subparsers(dest='command', required=True)
+    rebuild = subcommands.add_parser('rebuild')
+    rebuild.add_argument('--user-id', type=int, default=None)
+    rebuild.add_argument('--fix', action='store_true', help='overwrite aggregates that disagree with the log')
+    args = parser.parse_args()
+
+    with Session(get_engine()) as session:
+        user_ids = [args.user_id] if args.user_id else session.exec(select(User.id).order_by(User.id)).all()
+        mismatched = 0
+        for user_id in user_ids:
+            differences = rebuild_user(session, user_id, fix=args.fix)
+            if differences:
+                mismatched += 1
+                print(f"user {user_id}{' (fixed)' if args.fix else ''}:")
+                for difference in differences:
+                    print(f'    {difference}')
+        print(f'{len(user_ids)} users checked, {mismatched} disagreed with the log')
+
+
+if __name__ == '__main__':
+    main()
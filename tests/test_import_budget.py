@@ -0,0 +1,55 @@
+'''
+Importing the app must stay fast and free of side effects: each check imports it in a fresh interpreter
+(without DATABASE_URL, as tooling would). The budget is IMPORT_BUDGET_SECONDS, the median of IMPORT_BUDGET_RUNS imports.
+'''
+import statistics
+import subprocess
+import json
+import sys
+import os
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BUDGET_SECONDS = float(os.getenv('IMPORT_BUDGET_SECONDS', 1.5))
+RUNS = int(os.getenv('IMPORT_BUDGET_RUNS', 3))
+
+# Only needed once the app is running (the scheduler) or on first use (the scraper, Mailjet)
+LAZY_MODULES = ['apscheduler', 'PyMultiDictionary', 'mailjet_rest']
+
+PROBE = f'''
+import json, sys, threading, time
+started = time.perf_counter()
+import app
+elapsed = time.perf_counter() - started
+import database
+print(json.dumps({{
+    'seconds': elapsed,
+    'threads': threading.active_count(),
+    'engines': [name for name in ('_engine', '_async_engine') if getattr(database, name) is not None],
+    'lazy_modules_loaded': [name for name in {LAZY_MODULES!r} if name in sys.modules],
+}}))
+'''
+
+
+def probe():
+    env = {key: value for key, value in os.environ.items() if key != 'DATABASE_URL'}
+    env.setdefault('JWT_SECRET', 'import-budget')
+    output = subprocess.run([sys.executable, '-c', PROBE], cwd=ROOT, env=env, capture_output=True, text=True, check=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+@pytest.fixture(scope='module')
+def results():
+    return [probe() for _ in range(RUNS)]
+
+
+def test_import_is_within_budget(results):
+    median = statistics.median(result['seconds'] for result in results)
+    assert median <= BUDGET_SECONDS, f'import took {median:.3f}s, over the {BUDGET_SECONDS:.3f}s budget'
+
+
+def test_import_has_no_side_effects(results):
+    last = results[-1]
+    assert last['engines'] == [], 'import created database engines'
+    assert last['threads'] == 1, 'import started threads'
+    assert last['lazy_modules_loaded'] == [], 'import loaded modules meant to be lazy'
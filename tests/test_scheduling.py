@@ -0,0 +1,30 @@
+from datetime import datetime
+from helpers import update_box, MAX_BOX
+from scheduling import update_boxes
+import numpy as np
+import pytest
+
+
+def test_update_boxes_matches_update_box():
+    rng = np.random.default_rng(0)
+    boxes = rng.integers(1, MAX_BOX + 1, size=10000)
+    correct = rng.random(10000) < 0.5
+    now = datetime(2024, 3, 1, 12, 30, 15, 123456)
+
+    new_boxes, last_reviewed_date, next_review_dates = update_boxes(boxes, correct, now)
+
+    assert last_reviewed_date == now
+    for box, is_correct, new_box, next_review_date in zip(boxes.tolist(), correct.tolist(), new_boxes.tolist(), next_review_dates.tolist()):
+        assert (new_box, now, next_review_date) == update_box(box, is_correct, now)
+
+
+def test_update_boxes_accepts_no_words():
+    new_boxes, _, next_review_dates = update_boxes([], [])
+    assert new_boxes.tolist() == [] and next_review_dates.tolist() == []
+
+
+def test_update_boxes_rejects_impossible_boxes():
+    with pytest.raises(ValueError):
+        update_boxes([0, 3], [True, False])
+    with pytest.raises(ValueError):
+        update_boxes([MAX_BOX + 1], [True])
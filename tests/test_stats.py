@@ -0,0 +1,95 @@
+from datetime import datetime, date, timedelta
+from sqlalchemy import insert
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlmodel import SQLModel, Session, create_engine, select
+from sqlmodel.ext.asyncio.session import AsyncSession
+from models import User, Word, ReviewEvent, UserStats
+from stats import apply_events, read_stats, rebuild_user, review_event
+from schemas import WordDetails
+from auth import Principal
+import asyncio
+import os
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FIRST_DAY = date(2024, 3, 1)
+
+
+def at(day: int):
+    return datetime.combine(FIRST_DAY + timedelta(days=day), datetime.min.time()) + timedelta(hours=12)
+
+
+# Three words added on day 0 and reviewed over days 0, 1 and 3; the gap on day 2 breaks the streak
+DAYS = [
+    [review_event(1, 'Apple', 'added', box_after=1, now=at(0)),
+     review_event(1, 'Pear', 'added', box_after=1, now=at(0)),
+     review_event(1, 'Plum', 'added', box_after=1, now=at(0)),
+     review_event(1, 'Apple', 'reviewed', 1, 2, True, now=at(0))],
+    [review_event(1, 'Pear', 'reviewed', 1, 1, False, now=at(1)),
+     review_event(1, 'Apple', 'reviewed', 2, 3, True, now=at(1))],
+    [review_event(1, 'Plum', 'reviewed', 1, 2, True, now=at(3)),
+     review_event(1, 'Pear', 'deleted', box_before=1, now=at(3))],
+]
+
+
+class RecordingLog():
+    def __init__(self):
+        self.events = []
+
+    def record(self, events: list):
+        self.events += events
+
+
+def test_stats_match_the_review_log(tmp_path, monkeypatch):
+    path = tmp_path / 'stats.db'
+    engine = create_engine(f'sqlite:///{path}')
+    SQLModel.metadata.create_all(engine)
+    with Session(engine) as session:
+        session.add(User(id=1, username='a@example.com', password_hash='x', wants_updates=True))
+        session.commit()
+
+    # app.py mounts its static files and templates relative to the working directory
+    monkeypatch.chdir(ROOT)
+    import app
+    log = RecordingLog()
+    monkeypatch.setattr(app, 'review_log', log)
+
+    async def run():
+        async_engine = create_async_engine(f'sqlite+aiosqlite:///{path}')
+        for events in DAYS:
+            async with AsyncSession(async_engine) as session:
+                await apply_events(session, 1, events)
+                await session.execute(insert(ReviewEvent), events)
+                await session.commit()
+
+        async with AsyncSession(async_engine) as session:
+            stats = await session.get(UserStats, 1)
+            assert (stats.current_streak, stats.longest_streak, stats.last_review_day) == (1, 2, FIRST_DAY + timedelta(days=3))
+            session.add_all([
+                Word(word='Apple', user_id=1, box_number=3, last_reviewed_date=at(1), next_review_date=at(4)),
+                Word(word='Plum', user_id=1, box_number=2, last_reviewed_date=at(3), next_review_date=at(5)),
+            ])
+            await session.commit()
+
+        # The client still thinks Apple is in box 1; the stats must count it leaving box 3, where it really was
+        async with AsyncSession(async_engine) as session:
+            await app.update(WordDetails(word='Apple', user_id=1, current_box=1, is_correct=True), Principal(1, 'a@example.com', 0), session)
+        assert [(event['box_before'], event['box_after']) for event in log.events] == [(3, 2)]
+        async with AsyncSession(async_engine) as session:
+            await session.execute(insert(ReviewEvent), log.events)
+            await session.commit()
+
+        async with AsyncSession(async_engine) as session:
+            stats = await read_stats(session, 1)
+            assert (await session.exec(select(Word.box_number).where(Word.word == 'Apple'))).one() == 2
+        await async_engine.dispose()
+        return stats
+
+    stats = asyncio.run(run())
+    assert stats['words'] == 2
+    assert stats['boxes'] == {1: 0, 2: 2, 3: 0, 4: 0, 5: 0, 6: 0, 7: 0, 8: 0, 9: 0, 10: 0}
+    assert (stats['reviews'], stats['correct']) == (5, 4)
+    assert (stats['current_streak'], stats['longest_streak']) == (1, 2)
+    assert stats['reviews_per_day'][-1]['reviews'] == 1
+
+    with Session(engine) as session:
+        assert rebuild_user(session, 1) == []